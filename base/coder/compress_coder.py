@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import zlib
+from typing import Any
+
+from .coder_interface import CoderInterface
+from .json_coder import ORJSONCoder
+from .msgpack_coder import MsgPackCoder
+
+try:
+    import zstandard
+except ImportError:  # pragma: nocover
+    zstandard = None  # type: ignore
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: nocover
+    lz4_frame = None  # type: ignore
+
+
+# 首字节: 0x80 | 序列化类型 << 3 | 压缩类型, JSON文本不会以 >= 0x80 的字节开头, 可兼容旧数据
+CODERS = {1: ORJSONCoder, 2: MsgPackCoder}
+NONE, ZSTD, ZSTD_DICT, LZ4, ZLIB = 0, 1, 2, 3, 4
+ALGORITHMS = {'none': NONE, 'zstd': ZSTD, 'lz4': LZ4, 'zlib': ZLIB}
+LEVELS = {NONE: 0, ZSTD: 3, LZ4: 0, ZLIB: 6}
+
+
+class CompressCoder(CoderInterface):
+    '''
+    coder: 序列化方式 json/msgpack
+    algorithm: 压缩算法 zstd/lz4/zlib/none, 超过threshold字节才压缩
+    dictionary: zstd训练字典文件路径, 可用 CompressCoder.train 生成
+    '''
+
+    def __init__(
+        self, coder: str = 'json', algorithm: str = 'zstd', threshold: int = 1024, level: int = None, dictionary: str = None
+    ) -> None:
+        self._coder_id = 1 if coder == 'json' else 2
+        self._coder = CODERS[self._coder_id]
+        self._algorithm = ALGORITHMS[algorithm]
+        self._threshold = threshold
+        self._level = LEVELS[self._algorithm] if level is None else level
+        self._dict = None
+        if self._algorithm == ZSTD:
+            assert zstandard is not None, "zstandard must be installed to use zstd compression"
+            if dictionary:
+                with open(dictionary, mode='rb') as f:
+                    self._dict = zstandard.ZstdCompressionDict(f.read())
+                self._algorithm = ZSTD_DICT
+            self._compressor = zstandard.ZstdCompressor(level=self._level, dict_data=self._dict)
+        elif self._algorithm == LZ4:
+            assert lz4_frame is not None, "lz4 must be installed to use lz4 compression"
+        self._decompressors = {}
+
+    @classmethod
+    def train(cls, samples: list, size: int = 112640, coder: str = 'json') -> bytes:
+        assert zstandard is not None, "zstandard must be installed to train a dictionary"
+        coder = CODERS[1 if coder == 'json' else 2]
+        return zstandard.train_dictionary(size, [coder.encode(x) for x in samples]).as_bytes()
+
+    def encode(self, content: Any) -> bytes:
+        data = self._coder.encode(content)
+        algorithm = self._algorithm if len(data) >= self._threshold else NONE
+        if algorithm in (ZSTD, ZSTD_DICT):
+            data = self._compressor.compress(data)
+        elif algorithm == LZ4:
+            data = lz4_frame.compress(data, compression_level=self._level)
+        elif algorithm == ZLIB:
+            data = zlib.compress(data, self._level)
+        return bytes((0x80 | self._coder_id << 3 | algorithm,)) + data
+
+    def decode(self, value: bytes) -> Any:
+        if not value or value[0] < 0x80:
+            return ORJSONCoder.decode(value)
+        header = value[0]
+        coder, algorithm, data = CODERS[(header >> 3) & 0x0F], header & 0x07, memoryview(value)[1:]
+        if algorithm in (ZSTD, ZSTD_DICT):
+            data = self._decompressor(algorithm).decompress(data)
+        elif algorithm == LZ4:
+            data = lz4_frame.decompress(data)
+        elif algorithm == ZLIB:
+            data = zlib.decompress(data)
+        return coder.decode(data)
+
+    def _decompressor(self, algorithm: int) -> Any:
+        decompressor = self._decompressors.get(algorithm)
+        if decompressor is None:
+            assert zstandard is not None, "zstandard must be installed to decode zstd payloads"
+            if algorithm == ZSTD_DICT:
+                assert self._dict is not None, "zstd dictionary is required to decode this payload"
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._dict if algorithm == ZSTD_DICT else None)
+            self._decompressors[algorithm] = decompressor
+        return decompressor
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from typing import Any
+
+from .coder_interface import CoderInterface
+
+try:
+    import msgpack
+except ImportError:  # pragma: nocover
+    msgpack = None  # type: ignore
+
+
+class MsgPackCoder(CoderInterface):
+    @classmethod
+    def encode(self, content: Any) -> bytes:
+        assert msgpack is not None, "msgpack must be installed to use MsgPackCoder"
+        return msgpack.packb(content, use_bin_type=True, default=str)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        return msgpack.unpackb(value, raw=False, strict_map_key=False)
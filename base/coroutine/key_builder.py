@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import json
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Any, Awaitable, Callable, Tuple
+from base.coder.coder_interface import CoderInterface
+from base.coder.json_coder import ORJSONCoder
+from ..types import P, R
+
+try:
+    import xxhash
+except ImportError:  # pragma: nocover
+    xxhash = None  # type: ignore
+
+try:
+    import orjson
+except ImportError:  # pragma: nocover
+    orjson = None  # type: ignore
+
+
+_encoders: dict = {
+    set: lambda x: sorted(x, key=str),
+    frozenset: lambda x: sorted(x, key=str),
+}
+
+
+def register_encoder(cls: type, func: Callable[[Any], Any]) -> None:
+    '''
+    注册key编码时的类型转换, 如 register_encoder(BaseModel, lambda x: x.data)
+    '''
+    _encoders[cls] = func
+
+
+def _default(value: Any) -> Any:
+    func = _encoders.get(type(value))
+    if func is None:
+        for cls, item in _encoders.items():
+            if isinstance(value, cls):
+                func = item
+                break
+    return func(value) if func else str(value)
+
+
+def canonical_encode(value: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                value,
+                default=_default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        except TypeError:
+            pass
+    try:
+        return _json_encode(value)
+    except TypeError:
+        # 元组等作为dict的key, 或key类型混合无法排序时, key统一转为字符串
+        return _json_encode(_str_keys(value))
+
+
+def _json_encode(value: Any) -> bytes:
+    return json.dumps(value, default=_default, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _str_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {x if isinstance(x, str) else repr(x): _str_keys(y) for x, y in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_str_keys(x) for x in value]
+    return value
+
+
+def fast_hash(data: bytes) -> str:
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _layout(code: Any, module: str) -> Tuple[str, bool]:
+    name = f'{module}.{getattr(code, "co_qualname", code.co_name)}'
+    return name, code.co_argcount > 0 and code.co_varnames[0] in ('self', 'cls')
+
+
+def func_layout(func: Callable) -> Tuple[str, bool]:
+    func = inspect.unwrap(func)
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        return _layout(code, func.__module__ or '')
+    name = f'{getattr(func, "__module__", "") or ""}.{getattr(func, "__qualname__", repr(func))}'
+    try:
+        return name, 'self' in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return name, False
+
+
+def with_key_builder(key: Any = None, coder: CoderInterface = ORJSONCoder, prefix: str = '') -> str:
+    new_key = key if key and isinstance(key, str) else coder.encode(key).decode()
+    if '.' in new_key or len(new_key) > 32:
+        new_key = fast_hash(new_key.encode('utf-8'))
+    return f'{prefix}:{new_key}' if prefix else new_key
+
+
+class KeyBuilder:
+    '''
+    装饰时计算函数签名布局, 调用时只做编码和哈希;
+    key为可调用对象时按 key(*args, **kwargs) 的结果生成key, 跳过通用编码
+    '''
+
+    def __init__(
+        self, func: Callable[P, Awaitable[R]], key: Any = None, coder: CoderInterface = ORJSONCoder, prefix: str = ''
+    ) -> None:
+        self.key = key
+        self.coder = coder
+        self.prefix = prefix
+        self.static = with_key_builder(key, coder, prefix) if key and not callable(key) else None
+        self.name, self.skip_first = func_layout(func)
+
+    def __call__(self, args: tuple, kwargs: dict) -> str:
+        if self.static is not None:
+            return self.static
+        if self.key:
+            return with_key_builder(self.key(*args, **kwargs), self.coder, self.prefix)
+        new_key = fast_hash(canonical_encode((self.name, args[1:] if self.skip_first else args, kwargs)))
+        return f'{self.prefix}:{new_key}' if self.prefix else new_key
@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from functools import wraps
-from hashlib import md5
 import inspect
 from typing import Any, Awaitable, Callable
 from base.coder.coder_interface import CoderInterface
 from base.coder.json_coder import ORJSONCoder
 from base.di.service_location import BaseService
 from .channel import Channel
+from .key_builder import KeyBuilder, with_key_builder  # noqa: F401
 from ..types import P, R
 
 
@@ -38,32 +38,18 @@ def key_builder(
     coder: CoderInterface = ORJSONCoder,
     prefix: str = '',
 ) -> str:
-    ordered_kwargs = sorted(kwargs.items())
-    sig = inspect.signature(func)
-    tmp_param = (
-        (func.__module__ or "")
-        + '.'
-        + func.__name__
-        + str(args[1:] if 'self' in sig.parameters else args)
-        + str(ordered_kwargs)
-    )
-    return with_key_builder(key or tmp_param, coder, prefix)
-
-
-def with_key_builder(key: Any = None, coder: CoderInterface = ORJSONCoder, prefix: str = '') -> str:
-    new_key = key if key and isinstance(key, str) else coder.encode(key).decode()
-    if '.' in new_key or len(new_key) > 32:
-        new_key = md5(new_key.encode("utf-8")).hexdigest()
-    return f'{prefix}:{new_key}' if prefix else new_key
+    return KeyBuilder(func, key, coder, prefix)(args, kwargs)
 
 
 def shared(
     key: Any = None, timeout: float = 3, coder: CoderInterface = ORJSONCoder, prefix: str = '', only_lock=False
 ) -> Callable[P, Awaitable[R]]:
     def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        builder = KeyBuilder(func, key, coder, prefix)
+
         @wraps(func)
         async def wrapper_function(*args: P.args, **kwargs: P.kwargs) -> R:
-            new_key = key_builder(func, args, kwargs, key, coder, prefix)
+            new_key = builder(args, kwargs)
             shared_obj = Share.get_share(new_key)
             try:
                 await shared_obj.channel.push(new_key, timeout)
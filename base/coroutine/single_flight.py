@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from functools import wraps
+import inspect
+from typing import Any, Awaitable, Callable
+from base.coder.coder_interface import CoderInterface
+from base.coder.json_coder import ORJSONCoder
+from .key_builder import KeyBuilder
+from ..types import P, R
+
+
+class SingleFlight:
+    '''
+    同一个key并发调用只执行一次, 其余调用等待同一个Future的结果或异常;
+    函数在独立task中执行, 调用方被取消不会影响其他等待者
+    '''
+
+    def __init__(self) -> None:
+        self._calls: dict = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        total = self.executed + self.coalesced
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'in_flight': len(self._calls),
+            'coalesce_ratio': round(self.coalesced / total, 4) if total else 0,
+        }
+
+    async def do(self, key: str, func: Callable, args: tuple = (), kwargs: dict = None, window: float = 0) -> Any:
+        '''
+        window: 执行完成后结果继续共享的秒数, 0为完成即释放
+        '''
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(self._run(func, args, kwargs or {}))
+            task.add_done_callback(lambda x: self._done(key, x, window))
+            self._calls[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def forget(self, key: str) -> None:
+        self._calls.pop(key, None)
+
+    async def _run(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        return (await func(*args, **kwargs)) if inspect.iscoroutinefunction(func) else func(*args, **kwargs)
+
+    def _done(self, key: str, task: asyncio.Future, window: float) -> None:
+        if task.cancelled() or task.exception() is not None:
+            self.failed += 1
+            window = 0
+        if window > 0:
+            asyncio.get_running_loop().call_later(window, self._release, key, task)
+        else:
+            self._release(key, task)
+
+    def _release(self, key: str, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+flight = SingleFlight()
+
+
+def single_flight(
+    key: Any = None,
+    coder: CoderInterface = ORJSONCoder,
+    prefix: str = '',
+    window: float = 0,
+    group: SingleFlight = None,
+) -> Callable[P, Awaitable[R]]:
+    def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        builder = KeyBuilder(func, key, coder, prefix)
+        sf = group or flight
+
+        @wraps(func)
+        async def wrapper_function(*args: P.args, **kwargs: P.kwargs) -> R:
+            return await sf.do(builder(args, kwargs), func, args, kwargs, window)
+
+        return wrapper_function
+
+    return wrapper
@@ -9,6 +9,7 @@
 
 import asyncio
 from contextlib import asynccontextmanager
+from functools import lru_cache
 import re
 from loguru import logger
 from .util.datetime_utils import DateTime
@@ -47,30 +48,50 @@ def function_timer(name: str = None) -> Callable:
     return decorator
 
 
+_SNAKE_RE = re.compile(r'([a-z])([A-Z])')
+_CAMEL_RE = re.compile('_([a-zA-Z])')
+
+
+@lru_cache(maxsize=4096)
+def snake_name(name: str) -> str:
+    if '_' not in name:
+        name = _SNAKE_RE.sub(r'\1_\2', name)
+    return name.lower()
+
+
+@lru_cache(maxsize=4096)
+def camel_name(name: str) -> str:
+    return _CAMEL_RE.sub(lambda m: (m.group(1).upper()), name)
+
+
+def _convert_keys(params: dict, convert: Callable[[str], str], all: bool) -> dict:
+    temp_dict = {}
+    for name, value in params.items():
+        # Mongo操作符($in/$gte/$elemMatch...)及其子树保持原样
+        if name[:1] == '$':
+            temp_dict[name] = value
+            continue
+        if all:
+            if isinstance(value, dict):
+                value = _convert_keys(value, convert, all)
+            elif isinstance(value, list):
+                value = [_convert_keys(x, convert, all) if isinstance(x, dict) else x for x in value]
+        temp_dict[convert(name)] = value
+    return temp_dict
+
+
 def to_snake(params: dict, all: bool = True) -> dict:
     '''
-    将参数名的驼峰形式转为下划线形式
+    将参数名的驼峰形式转为下划线形式, 字段名转换结果有缓存
     @param params:
     @return:
     '''
-    temp_dict = {}
-    for name, value in params.items():
-        new_name = name
-        if '_' not in name:
-            new_name = re.sub(r'([a-z])([A-Z])', r'\1_\2', name)
-        temp_dict.update({new_name.lower(): to_snake(value) if all and isinstance(value, dict) else value})
-
-    return temp_dict
+    return _convert_keys(params, snake_name, all)
 
 
 def to_lower_camel(params: dict, all: bool = True):
     """下划线转小驼峰法命名"""
-    temp_dict = {}
-    for name, value in params.items():
-        new_name = re.sub('_([a-zA-Z])', lambda m: (m.group(1).upper()), name)
-        temp_dict.update({new_name: to_lower_camel(value) if all and isinstance(value, dict) else value})
-
-    return temp_dict
+    return _convert_keys(params, camel_name, all)
 
 
 def encryption_password_or_decode(pwd: str, hashed_password: str = None) -> Union[str, bool]:
@@ -4,10 +4,30 @@ import asyncio
 from functools import wraps
 from loguru import logger
 import inspect
-from typing import Awaitable, Callable, Union
+from typing import Any, Awaitable, Callable, Set, Union
 from base.types import P, R
 
 
+_background: Set[asyncio.Future] = set()
+
+
+def _done(task: asyncio.Future) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.opt(exception=task.exception()).warning(f"Background task {getattr(task, 'label', '')} failed")
+
+
+def spawn(coro: Awaitable[Any], label: str = '') -> asyncio.Future:
+    '''
+    后台任务: 保留引用直到完成, 避免执行中被回收, 未处理的异常记录日志
+    '''
+    task = asyncio.ensure_future(coro)
+    task.label = label
+    _background.add(task)
+    task.add_done_callback(_done)
+    return task
+
+
 class NotRetryException(Exception):
     ...
 
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import timeit
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = '''json_coder:
+  (): base.coder.json_coder.ORJSONCoder
+id_generator:
+  (): base.util.id_generator.UUIDIdGenerator
+cache.default:
+  (): db.memory.lru_cache.LRUCache
+'''
+
+
+def setup() -> None:
+    '''
+    benchmark不依赖项目配置, 未设置CONFIG_PATH时生成最小配置
+    '''
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    if not os.environ.get('CONFIG_PATH'):
+        path = tempfile.mkdtemp(prefix='bench_configs_')
+        with open(os.path.join(path, 'app.yaml'), mode='w', encoding='utf-8') as f:
+            f.write(CONFIG)
+        os.environ['CONFIG_PATH'] = path
+
+
+def bench(name: str, func: Callable, number: int = 10000, repeat: int = 5) -> float:
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f'{name:<48} {best * 1e6:>10.3f} us/op')
+    return best
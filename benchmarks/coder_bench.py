@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''
+python benchmarks/coder_bench.py
+不同大小的index分页结果下各coder的编码/解码耗时和体积
+'''
+
+import random
+
+import bench_env
+
+bench_env.setup()
+
+from base.coder.compress_coder import CompressCoder  # noqa: E402
+from base.coder.json_coder import ORJSONCoder  # noqa: E402
+from base.coder.msgpack_coder import MsgPackCoder  # noqa: E402
+
+
+def payload(size: int) -> dict:
+    rnd = random.Random(size)
+    return {
+        'records': [
+            {
+                'id': f'{rnd.getrandbits(128):032x}',
+                'name': f'item-{i}',
+                'status': rnd.choice(['active', 'disabled', 'pending']),
+                'tags': rnd.sample(['a', 'b', 'c', 'd', 'e', 'f'], 3),
+                'price': round(rnd.uniform(0, 1000), 2),
+                'createTime': 1700000000 + i,
+                'updateTime': 1700000000 + i * 2,
+            }
+            for i in range(size)
+        ],
+        'total': size * 10,
+    }
+
+
+def main() -> None:
+    coders = {
+        'orjson': ORJSONCoder,
+        'msgpack': MsgPackCoder,
+        'json+zstd': CompressCoder('json', 'zstd'),
+        'msgpack+zstd': CompressCoder('msgpack', 'zstd'),
+        'json+lz4': CompressCoder('json', 'lz4'),
+        'json+zlib': CompressCoder('json', 'zlib'),
+    }
+    for size in (1, 10, 100, 1000):
+        data = payload(size)
+        print(f'--- records={size}')
+        for name, coder in coders.items():
+            encoded = coder.encode(data)
+            number = max(10, 20000 // size)
+            encode = bench_env.bench(f'{name} encode', lambda: coder.encode(data), number=number, repeat=3)
+            decode = bench_env.bench(f'{name} decode', lambda: coder.decode(encoded), number=number, repeat=3)
+            print(f'{name:<48} {len(encoded):>10} bytes  total {(encode + decode) * 1e6:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
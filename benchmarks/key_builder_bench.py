@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+'''
+python benchmarks/key_builder_bench.py
+对比旧版 key_builder(每次 inspect.signature + str + md5) 与 KeyBuilder
+'''
+
+import inspect
+from hashlib import md5
+
+import bench_env
+
+bench_env.setup()
+
+from base.coroutine.key_builder import KeyBuilder, with_key_builder  # noqa: E402
+from base.coroutine.shared import key_builder  # noqa: E402
+from db.mongodb.helper.match_helper import match_helper  # noqa: E402
+
+
+def legacy_key_builder(func, args, kwargs, key=None, prefix=''):
+    ordered_kwargs = sorted(kwargs.items())
+    sig = inspect.signature(func)
+    tmp_param = (
+        (func.__module__ or "")
+        + '.'
+        + func.__name__
+        + str(args[1:] if 'self' in sig.parameters else args)
+        + str(ordered_kwargs)
+    )
+    new_key = key or tmp_param
+    if '.' in new_key or len(new_key) > 32:
+        new_key = md5(new_key.encode("utf-8")).hexdigest()
+    return f'{prefix}:{new_key}' if prefix else new_key
+
+
+class Dao:
+    async def query(self, pipeline: list, sort: dict = None, page: int = 1, page_size: int = 20) -> list:
+        return []
+
+
+def main() -> None:
+    func = Dao.query
+    small = ((Dao(), [{'$match': {'id': 'abc'}}]), {'page': 1})
+    pipeline = (
+        match_helper.pipeline()
+        .match({'status': {'$in': [1, 2, 3]}, 'type': 'order', 'create_time': {'$gte': 1700000000, '$lt': 1800000000}})
+        .lookup({'from': 'user', 'localField': 'uid', 'foreignField': 'id', 'as': 'user'})
+        .unwind({'path': '$user'})
+        .sort({'create_time': -1})
+        .data
+    )
+    large = ((Dao(), pipeline), {'sort': {'create_time': -1, 'id': 1}, 'page': 3, 'page_size': 50})
+    builder = KeyBuilder(func, prefix='bench')
+    custom = KeyBuilder(func, key=lambda self, pipeline, **kwargs: pipeline[0]['$match']['id'], prefix='bench')
+
+    for label, (args, kwargs) in (('small', small), ('large', large)):
+        bench_env.bench(f'legacy key_builder [{label}]', lambda: legacy_key_builder(func, args, kwargs, prefix='bench'))
+        bench_env.bench(f'key_builder() compat [{label}]', lambda: key_builder(func, args, kwargs, prefix='bench'))
+        bench_env.bench(f'KeyBuilder precomputed [{label}]', lambda: builder(args, kwargs))
+    bench_env.bench('KeyBuilder custom strategy [small]', lambda: custom(*small))
+    bench_env.bench('with_key_builder static', lambda: with_key_builder('static.key', prefix='bench'))
+
+
+if __name__ == '__main__':
+    main()
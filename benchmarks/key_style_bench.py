@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+'''
+python benchmarks/key_style_bench.py
+对比旧版 to_snake/to_lower_camel(每个key执行re.sub) 与带缓存的字段名转换, 按单个文档计时
+'''
+
+import re
+
+import bench_env
+
+bench_env.setup()
+
+from base.functions import to_lower_camel, to_snake  # noqa: E402
+
+
+def legacy_to_snake(params: dict, all: bool = True) -> dict:
+    temp_dict = {}
+    for name, value in params.items():
+        new_name = name
+        if '_' not in name:
+            new_name = re.sub(r'([a-z])([A-Z])', r'\1_\2', name)
+        temp_dict.update({new_name.lower(): legacy_to_snake(value) if all and isinstance(value, dict) else value})
+    return temp_dict
+
+
+def legacy_to_lower_camel(params: dict, all: bool = True) -> dict:
+    temp_dict = {}
+    for name, value in params.items():
+        new_name = re.sub('_([a-zA-Z])', lambda m: (m.group(1).upper()), name)
+        temp_dict.update({new_name: legacy_to_lower_camel(value) if all and isinstance(value, dict) else value})
+    return temp_dict
+
+
+def order(i: int) -> dict:
+    return {
+        'id': f'order-{i}',
+        'order_no': f'NO{i:08d}',
+        'user_id': f'user-{i % 100}',
+        'shop_id': 'shop-1',
+        'order_status': 2,
+        'pay_status': 1,
+        'total_amount': 199.5,
+        'discount_amount': 10,
+        'pay_amount': 189.5,
+        'pay_time': 1700000000 + i,
+        'create_time': 1700000000,
+        'update_time': 1700000100,
+        'receiver_info': {
+            'receiver_name': 'name',
+            'receiver_phone': '13800000000',
+            'province_code': '440000',
+            'city_code': '440300',
+            'detail_address': 'address',
+        },
+        'extra_info': {'source_channel': 'app', 'device_type': 'ios', 'app_version': '1.2.3'},
+    }
+
+
+def main() -> None:
+    snake = order(1)
+    camel = to_lower_camel(snake)
+    matcher = {'userId': 'user-1', 'orderStatus': {'$in': [1, 2]}, 'createTime': {'$gte': 1700000000, '$lt': 1800000000}}
+    for label, func in (('legacy', legacy_to_lower_camel), ('cached', to_lower_camel)):
+        bench_env.bench(f'{label} to_lower_camel [order]', lambda: func(snake))
+    for label, func in (('legacy', legacy_to_snake), ('cached', to_snake)):
+        bench_env.bench(f'{label} to_snake [order]', lambda: func(camel))
+        bench_env.bench(f'{label} to_snake [matcher]', lambda: func(matcher))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+from base.coroutine.key_builder import register_encoder
 from base.di.service_location import config, service
-from base.functions import to_lower_camel, to_snake
+from base.functions import camel_name, snake_name, to_lower_camel, to_snake
 from base.util import date_utils
 
 
 class BaseModel:
+    __slots__ = ('_key_style', '_key', '_use_time', '_id_generator', '_data')
+
     STYLE_NONE = 'NONE'
     STYLE_SNAKE = 'SNAKE'
     STYLE_LOWER_CAMEL = 'LOWER_CAMEL'
@@ -47,6 +50,9 @@ class BaseModel:
     def copy(self) -> 'BaseModel':
         return BaseModel(self._key_style)
 
+    def projection(self) -> dict:
+        return {}
+
     def to_dict(self) -> dict:
         keep_key = self._key_style != self.STYLE_LOWER_CAMEL
         key = self._data.pop(self._key, None)
@@ -58,3 +64,52 @@ class BaseModel:
             pb_tmp.update({create_time_key: time})
             self._data.update({'update_time' if keep_key and 'update_time' in self._data else 'updateTime': time})
         return pb_tmp
+
+
+class _SchemaMeta(type):
+    def __new__(mcs, name: str, bases: tuple, namespace: dict, **kwargs) -> type:
+        # 子类未声明 __slots__ 时补充, 实例不创建 __dict__
+        namespace.setdefault('__slots__', ())
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+
+class SchemaModel(BaseModel, metaclass=_SchemaMeta):
+    '''
+    声明字段的模型, 如:
+        class User(SchemaModel):
+            fields = ('name', 'user_type')
+    字段名映射在类定义时计算, load只做字典查找且只保留声明的字段(嵌套dict原样保留);
+    projection返回声明字段, DAO据此自动投影
+    '''
+
+    fields: tuple = ()
+    _names: dict = {}
+    _projections: dict = {}
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        # 主键和时间字段由to_dict维护, 默认包含
+        fields = dict.fromkeys(('id', 'create_time', 'update_time') + tuple(cls.fields))
+        cls._names = {BaseModel.STYLE_NONE: {}, BaseModel.STYLE_SNAKE: {}, BaseModel.STYLE_LOWER_CAMEL: {}}
+        for field in fields:
+            snake, camel = snake_name(field), camel_name(field)
+            cls._names[BaseModel.STYLE_NONE].update({field: field, snake: snake, camel: camel})
+            for style, name in ((BaseModel.STYLE_SNAKE, snake), (BaseModel.STYLE_LOWER_CAMEL, camel)):
+                cls._names[style].update({field: name, snake: name, camel: name})
+        # to_dict 按数据内容选择 create_time/createTime, 两种写法都需要投影
+        times = ('create_time', 'createTime', 'update_time', 'updateTime')
+        cls._projections = {style: dict.fromkeys((*names.values(), *times), True) for style, names in cls._names.items()}
+
+    def load(self, data: dict) -> 'SchemaModel':
+        names = self._names[self._key_style]
+        self._data = {names[k]: v for k, v in data.items() if k in names}
+        return self
+
+    def copy(self) -> 'SchemaModel':
+        return self.__class__(self._key_style, self._use_time, self._key)
+
+    def projection(self) -> dict:
+        return self._projections[self._key_style]
+
+
+register_encoder(BaseModel, lambda x: x.data)
@@ -2,16 +2,24 @@
 
 from abc import ABCMeta, abstractmethod
 import asyncio
+import fnmatch
 from functools import wraps
+import inspect
 from inspect import iscoroutinefunction
+import math
+import random
 import time
-from typing import Any, Awaitable, Callable, Optional, Tuple
+from uuid import uuid4
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from loguru import logger
-from base.coroutine.shared import shared, key_builder
-from base.di.service_location import service
+from redis.exceptions import LockError
+from base.coroutine.key_builder import KeyBuilder
+from base.coroutine.single_flight import flight
+from base.di.service_location import config, service
 from base.coder.coder_interface import CoderInterface
 from base.coder.json_coder import ORJSONCoder
 from base.types import P, R
+from base.util.wraps import spawn
 
 
 class CacheInterface(metaclass=ABCMeta):
@@ -31,6 +39,25 @@ class CacheInterface(metaclass=ABCMeta):
     async def delete(self, key: str) -> Optional[int]:
         pass
 
+    async def get_many(self, keys: List[str]) -> List[Tuple[int, Optional[bytes]]]:
+        return [await self.get_with_ttl(key) for key in keys]
+
+    async def set_many(self, items: Dict[str, Any], expire: Optional[float] = None) -> None:
+        for key, value in items.items():
+            await self.set(key, value, expire)
+
+    async def delete_many(self, keys: List[str]) -> int:
+        return sum([(await self.delete(key)) or 0 for key in keys])
+
+    async def keys(self, pattern: str = '*') -> List[str]:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support keys')
+
+    async def delete_pattern(self, pattern: str) -> int:
+        '''
+        默认按 keys 查找后删除, 两者都未实现时调用才抛出 NotImplementedError
+        '''
+        return await self.delete_many(await self.keys(pattern))
+
 
 class MemoryCache(CacheInterface):
     cache_map: dict = {}
@@ -43,7 +70,7 @@ class MemoryCache(CacheInterface):
         return set_time + ttl - int(time.time()) if ttl > 0 else ttl, value
 
     async def get(self, key: str) -> Optional[bytes]:
-        _, _, result = MemoryCache.cache_map.get(key, None)
+        _, _, result = MemoryCache.cache_map.get(key, (0, 0, None))
         return result
 
     async def set(self, key: str, value: Any, expire: Optional[float] = None) -> None:
@@ -57,45 +84,247 @@ class MemoryCache(CacheInterface):
             asyncio.get_running_loop().create_task(ttl())
 
     async def delete(self, key: str) -> Optional[int]:
-        _, _, result = MemoryCache.cache_map.pop(key, None)
-        if result:
+        _, _, result = MemoryCache.cache_map.pop(key, (0, 0, None))
+        if result is not None:
             return 1
         return 0
 
+    async def delete_pattern(self, pattern: str) -> int:
+        return await self.delete_many(fnmatch.filter(list(MemoryCache.cache_map.keys()), pattern))
+
+
+_refreshing: set = set()
+_local_stores: set = set()
+
+
+def tag_store() -> Optional[CacheInterface]:
+    name = config('cache_tag_store', 'cache.default')
+    if not config(name):
+        return None
+    store = service.get(name)
+    if name not in _local_stores:
+        from db.memory.lru_cache import LRUCache
+
+        if isinstance(store, (MemoryCache, LRUCache)):
+            _local_stores.add(name)
+            logger.warning(f"Tag store {name} is a per-process cache, tag invalidation will not reach other workers")
+    return store
+
+
+async def tag_version(tags: List[str]) -> str:
+    '''
+    tag当前版本号, 缓存key拼接版本号, 版本号变化即整体失效; 版本号丢失时重新生成
+    '''
+    cache_obj = tag_store()
+    if cache_obj is None:
+        raise RuntimeError(f"Tag store {config('cache_tag_store', 'cache.default')} is not configured")
+    keys = [f'tag:{x}' for x in tags]
+    versions = [value for _, value in await cache_obj.get_many(keys)]
+    missing = {key: uuid4().hex[:12].encode() for key, value in zip(keys, versions) if value is None}
+    if missing:
+        await cache_obj.set_many(missing)
+    versions = [value if value is not None else missing[key] for key, value in zip(keys, versions)]
+    return '.'.join(x.decode() if isinstance(x, bytes) else str(x) for x in versions)
+
+
+async def invalidate_tags(tags: List[str]) -> None:
+    cache_obj = tag_store()
+    if cache_obj is None:
+        return
+    await cache_obj.set_many({f'tag:{x}': uuid4().hex[:12].encode() for x in tags})
+
 
 def cache(
-    key: Any = None, name: str = 'cache.default', expire: float = None, coder: CoderInterface = ORJSONCoder, prefix: str = ''
+    key: Any = None,
+    name: str = 'cache.default',
+    expire: float = None,
+    coder: CoderInterface = ORJSONCoder,
+    prefix: str = '',
+    stale: float = 0,
+    beta: float = 0,
+    lock: str = None,
+    lock_timeout: float = 10,
+    tags: List[str] = None,
 ) -> Callable[P, Awaitable[R]]:
+    '''
+    stale: 过期后仍可返回旧值的秒数, 期间只有一个后台任务刷新(stale-while-revalidate)
+    beta: XFetch提前刷新系数, 越大越早刷新, 0为关闭
+    lock: redis服务名, 设置后跨进程只有一个worker重算同一个key
+    tags: 缓存依赖的tag, invalidate_tags 后所有相关缓存失效
+    '''
+    envelope = bool(expire and expire > 0 and (stale > 0 or beta > 0))
+    if tags and tag_store() is None:
+        raise ValueError(f"cache tags={tags} require the tag store {config('cache_tag_store', 'cache.default')} to be configured")
+
     def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
-        @shared(coder=coder, prefix=prefix)
-        @wraps(func)
-        async def wrapper_function(*args: P.args, **kwargs: P.kwargs) -> R:
-            if expire and expire < 0:
-                return await func(*args, **kwargs)
-            new_key = key_builder(func, args, kwargs, key, coder, prefix)
-            cache_obj = service.get(name)
+        builder = KeyBuilder(func, key, coder, prefix)
+
+        async def compute(args: tuple, kwargs: dict) -> bytes:
+            start = time.monotonic()
+            result = (await func(*args, **kwargs)) if iscoroutinefunction(func) else func(*args, **kwargs)
+            return coder.encode([result, time.monotonic() - start] if envelope else result)
+
+        async def load(cache_obj: CacheInterface, new_key: str) -> Tuple[Optional[int], Optional[bytes], float]:
             try:
                 ttl, result = await cache_obj.get_with_ttl(new_key)
-                result = coder.decode(result) if result is not None else None
+                if not envelope or result is None:
+                    return ttl, result, 0
+                _, delta = coder.decode(result)
+                return (ttl - stale if ttl >= 0 else None), result, delta
             except Exception:
                 logger.warning(
                     f"Error retrieving cache={name} key={str(new_key)}",
                     exc_info=True,
                 )
-                ttl, result = 0, None
+                return 0, None, 0
+
+        async def store(cache_obj: CacheInterface, new_key: str, result: bytes) -> None:
+            try:
+                await cache_obj.set(new_key, result, expire + stale if envelope else expire)
+            except Exception:
+                logger.warning(
+                    f"Error setting cache={name} key={str(new_key)}",
+                    exc_info=True,
+                )
+
+        def is_fresh(ttl: Optional[int], delta: float) -> bool:
+            if ttl is None:
+                return True
+            if ttl < 0:
+                return False
+            if not beta or not delta:
+                return True
+            return ttl > -delta * beta * math.log(1 - random.random())
+
+        async def recompute(cache_obj: CacheInterface, new_key: str, args: tuple, kwargs: dict) -> bytes:
+            if not lock:
+                result = await compute(args, kwargs)
+                await store(cache_obj, new_key, result)
+                return result
+            from db.redis.redis_manager import with_redis_lock
+
+            async with with_redis_lock(f'lock:{new_key}', lock, lock_timeout):
+                ttl, result, _ = await load(cache_obj, new_key)
+                if result is not None and (not envelope or is_fresh(ttl, 0)):
+                    return result
+                result = await compute(args, kwargs)
+                await store(cache_obj, new_key, result)
+                return result
+
+        async def refresh(cache_obj: CacheInterface, new_key: str, args: tuple, kwargs: dict) -> None:
+            try:
+                if lock:
+                    from db.redis.redis_manager import with_redis_lock
+
+                    async with with_redis_lock(f'lock:{new_key}', lock, lock_timeout, blocking_timeout=0):
+                        await store(cache_obj, new_key, await compute(args, kwargs))
+                else:
+                    await store(cache_obj, new_key, await compute(args, kwargs))
+            except LockError:
+                logger.debug(f"Skip refresh key={str(new_key)}, locked by another worker")
+            except Exception:
+                logger.warning(f"Error refreshing cache={name} key={str(new_key)}", exc_info=True)
+            finally:
+                _refreshing.discard(f"{name}:{new_key}")
+
+        async def fetch(new_key: str, args: tuple, kwargs: dict) -> bytes:
+            cache_obj = service.get(name)
+            ttl, result, delta = await load(cache_obj, new_key)
             if result is None:
-                result = (await func(*args, **kwargs)) if iscoroutinefunction(func) else func(*args, **kwargs)
-                try:
-                    await cache_obj.set(new_key, coder.encode(result), expire)
-                except Exception:
-                    logger.warning(
-                        f"Error setting cache={name} key={str(new_key)}",
-                        exc_info=True,
-                    )
+                result = await recompute(cache_obj, new_key, args, kwargs)
             else:
+                if envelope and not is_fresh(ttl, delta) and f"{name}:{new_key}" not in _refreshing:
+                    _refreshing.add(f"{name}:{new_key}")
+                    spawn(refresh(cache_obj, new_key, args, kwargs), f"refresh {name}:{new_key}")
                 logger.debug(f"Get key={str(new_key)} from Cache={name} ttl={ttl}")
             return result
 
+        @wraps(func)
+        async def wrapper_function(*args: P.args, **kwargs: P.kwargs) -> R:
+            if expire and expire < 0:
+                return await func(*args, **kwargs)
+            new_key = builder(args, kwargs)
+            if tags:
+                try:
+                    new_key = f'{new_key}:{await tag_version(tags)}'
+                except Exception:
+                    logger.warning(f"Error retrieving tags={tags} from cache", exc_info=True)
+                    return await func(*args, **kwargs)
+            # 合并的调用共享同一份编码结果, 各自解码避免互相修改
+            result = await flight.do(f'{name}:{new_key}', fetch, (new_key, args, kwargs))
+            try:
+                result = coder.decode(result)
+            except Exception:
+                logger.warning(f"Error decoding cache={name} key={str(new_key)}", exc_info=True)
+                return await func(*args, **kwargs)
+            return result[0] if envelope else result
+
+        return wrapper_function
+
+    return wrapper
+
+
+def cache_many(
+    arg: str = 'ids',
+    name: str = 'cache.default',
+    expire: float = None,
+    coder: CoderInterface = ORJSONCoder,
+    prefix: str = '',
+    id_key: str = 'id',
+    mapping: bool = False,
+) -> Callable[P, Awaitable[R]]:
+    '''
+    按id批量缓存: arg为id列表参数名, 只对未命中的id调用原函数, 结果一次写回
+    mapping: 原函数返回 {id: value} 为True, 返回带id_key字段的记录列表为False
+    '''
+
+    def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        builder = KeyBuilder(func, None, coder, prefix)
+        signature = inspect.signature(func)
+        position = list(signature.parameters).index(arg)
+
+        def item_key(bound: inspect.BoundArguments, value: Any) -> str:
+            # 按签名归一化参数, 位置/关键字传参和默认值生成相同的key, id放在自己的参数位置
+            bound.arguments[arg] = value
+            return builder(bound.args, bound.kwargs)
+
+        def replace(args: tuple, kwargs: dict, value: Any) -> Tuple[tuple, dict]:
+            if len(args) > position:
+                return args[:position] + (value,) + args[position + 1 :], kwargs
+            return args, dict(kwargs, **{arg: value})
+
+        @wraps(func)
+        async def wrapper_function(*args: P.args, **kwargs: P.kwargs) -> R:
+            ids = args[position] if len(args) > position else kwargs.get(arg)
+            if (expire and expire < 0) or not ids:
+                return (await func(*args, **kwargs)) if iscoroutinefunction(func) else func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            keys = {x: item_key(bound, x) for x in dict.fromkeys(ids)}
+            cache_obj = service.get(name)
+            found = {}
+            try:
+                for x, (_, value) in zip(keys.keys(), await cache_obj.get_many(list(keys.values()))):
+                    if value is not None:
+                        found[x] = coder.decode(value)
+            except Exception:
+                logger.warning(f"Error retrieving cache={name} keys={len(keys)}", exc_info=True)
+            missing = [x for x in keys if x not in found]
+            if missing:
+                new_args, new_kwargs = replace(args, kwargs, missing)
+                result = (await func(*new_args, **new_kwargs)) if iscoroutinefunction(func) else func(*new_args, **new_kwargs)
+                result = dict(result or {}) if mapping else {x.get(id_key): x for x in result or []}
+                result = {x: result[x] for x in missing if x in result}
+                found.update(result)
+                try:
+                    await cache_obj.set_many({keys[x]: coder.encode(value) for x, value in result.items()}, expire)
+                except Exception:
+                    logger.warning(f"Error setting cache={name} keys={len(result)}", exc_info=True)
+            logger.debug(f"Get keys={len(keys) - len(missing)}/{len(keys)} from Cache={name}")
+            if mapping:
+                return {x: found[x] for x in keys if x in found}
+            return [found[x] for x in keys if x in found]
+
         return wrapper_function
 
     return wrapper
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
-from typing import List, Union
+from typing import Any, AsyncGenerator, Awaitable, AsyncIterable, Iterable, List, Union
 
 from db.base_model import BaseModel
 
 
 class DaInterface(metaclass=ABCMeta):
+    '''
+    可选能力(批量写入、缓冲写入、按id合并查询、流式读取、游标分页、索引建议)默认抛出 NotImplementedError, 实现类按需覆盖
+    '''
+
     @abstractmethod
     async def save(self, model: Union[BaseModel, dict], matcher: dict = None, projection={}) -> dict:
         pass
@@ -15,6 +19,22 @@ class DaInterface(metaclass=ABCMeta):
     async def batch_save(self, models: list[Union[BaseModel, dict]], matcher: list = None) -> int:
         pass
 
+    async def bulk_save(
+        self,
+        models: Union[Iterable, AsyncIterable],
+        matcher: list = None,
+        upsert: bool = True,
+        chunk_size: int = 1000,
+        concurrency: int = 4,
+        ordered: bool = False,
+    ) -> dict:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support bulk_save')
+
+    async def save_buffered(
+        self, model: Union[BaseModel, dict], matcher: dict = None, upsert: bool = True, wait: bool = False
+    ) -> Awaitable:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support save_buffered')
+
     @abstractmethod
     async def updateAll(self, data: dict, matcher: dict) -> int:
         pass
@@ -23,12 +43,28 @@ class DaInterface(metaclass=ABCMeta):
     async def get(self, id: str = None, matcher: dict = {}, projection: dict = {}, sort: list = [], **kwargs) -> dict:
         pass
 
+    async def load(self, id: Any) -> dict:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support load')
+
+    async def load_many(self, ids: List[Any]) -> List[dict]:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support load_many')
+
     @abstractmethod
     async def list(
         self, matcher: dict = {}, projection: dict = {}, page: int = 1, page_size: int = 0, sort=[], **kwargs
     ) -> List:
         pass
 
+    def stream(
+        self, matcher: dict = {}, projection: dict = {}, sort=[], batch_size: int = 1000, batched: bool = False, **kwargs
+    ) -> AsyncGenerator:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support stream')
+
+    def iter_query(
+        self, pipeline: List = [], sort={}, batch_size: int = 1000, batched: bool = False, **kwargs
+    ) -> AsyncGenerator:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support iter_query')
+
     @abstractmethod
     async def count(self, matcher: dict = {}) -> int:
         pass
@@ -46,21 +82,57 @@ class DaInterface(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    async def index(self, param: List = [], page: int = 1, page_size: int = 20, sort={}, cached: dict = None) -> dict:
+    async def index(
+        self,
+        param: List = [],
+        page: int = 1,
+        page_size: int = 20,
+        sort={},
+        cached: dict = None,
+        cursor: str = None,
+        with_total: bool = False,
+        count: str = 'exact',
+        count_cached: dict = None,
+        optimize: bool = True,
+    ) -> dict:
         pass
 
+    async def keyset(
+        self,
+        param: List = [],
+        cursor: str = '',
+        page_size: int = 20,
+        sort={},
+        with_total: bool = False,
+        cached: dict = None,
+        optimize: bool = True,
+    ) -> dict:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support keyset')
+
     @abstractmethod
     def default_query(self, matcher: dict) -> dict:
         pass
 
     @abstractmethod
-    async def count_query(self, param: List, cached: dict = None) -> int:
+    async def count_query(self, param: List, cached: dict = None, count: str = 'exact', cap: int = 10000) -> Union[int, str]:
         pass
 
     @abstractmethod
-    async def query(self, pipeline: List = [], sort={}, page: int = 1, page_size: int = 0, cached: dict = None) -> List:
+    async def query(
+        self,
+        pipeline: List = [],
+        sort={},
+        page: int = 1,
+        page_size: int = 0,
+        cached: dict = None,
+        optimize: bool = True,
+        keep: List[str] = (),
+    ) -> List:
         pass
 
+    def index_advice(self) -> dict:
+        raise NotImplementedError(f'{self.__class__.__name__} does not support index_advice')
+
     @abstractmethod
     async def distinct(self, key: str, matcher: dict = {}, cached: dict = None) -> List:
         pass
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import fnmatch
+import heapq
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from loguru import logger
+from db.cache_helper import CacheInterface
+
+
+def sizeof(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(sizeof(x) for x in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache(CacheInterface):
+    '''
+    有界进程内缓存: 按条目数/字节数做LRU淘汰, 过期由单个协程按最小堆统一清理
+    '''
+
+    def __init__(self, max_size: int = 10000, max_bytes: int = 0, interval: float = 1) -> None:
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._data: OrderedDict = OrderedDict()
+        self._heap: list = []
+        self._bytes = 0
+        self._sweeper: asyncio.Task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _lookup(self, key: str) -> Optional[tuple]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        if item[0] and item[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def _remove(self, key: str) -> Optional[tuple]:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+        return item
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_size and len(self._data) > self.max_size) or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, item = self._data.popitem(last=False)
+            self._bytes -= item[2]
+            self.evictions += 1
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        item = self._lookup(key)
+        if item is None:
+            return -2, None
+        expire_at, value, _ = item
+        return (max(round(expire_at - time.monotonic()), 0) if expire_at else -1), value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._lookup(key)
+        return item[1] if item is not None else None
+
+    async def set(self, key: str, value: Any, expire: Optional[float] = None) -> None:
+        self._remove(key)
+        expire_at = time.monotonic() + expire if expire and expire > 0 else 0
+        size = sizeof(value)
+        self._data[key] = (expire_at, value, size)
+        self._bytes += size
+        if expire_at:
+            heapq.heappush(self._heap, (expire_at, key))
+            if len(self._heap) > 2 * len(self._data) + 64:
+                self._heap = [(x[0], k) for k, x in self._data.items() if x[0]]
+                heapq.heapify(self._heap)
+            if self._sweeper is None or self._sweeper.done():
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+        self._evict()
+
+    async def delete(self, key: str) -> Optional[int]:
+        return 0 if self._remove(key) is None else 1
+
+    async def delete_pattern(self, pattern: str) -> int:
+        return await self.delete_many(fnmatch.filter(list(self._data.keys()), pattern))
+
+    async def clear(self) -> None:
+        self._data.clear()
+        self._heap.clear()
+        self._bytes = 0
+
+    async def _sweep(self) -> None:
+        try:
+            while self._heap:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    expire_at, key = heapq.heappop(self._heap)
+                    item = self._data.get(key)
+                    if item is not None and item[0] == expire_at:
+                        self._remove(key)
+                        self.expirations += 1
+                if self._heap:
+                    await asyncio.sleep(min(max(self._heap[0][0] - now, 0), self.interval))
+        except Exception as e:
+            logger.error(f'LRUCache sweeper stopped: {e}')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterator, List, Tuple
+from loguru import logger
+
+try:
+    import grpc
+except ImportError:  # pragma: nocover
+    grpc = None
+
+# 服务端没有处理请求(连接不可用/限流拒绝), 重试不会重复写入
+UNSENT_STATUS = ('UNAVAILABLE', 'RESOURCE_EXHAUSTED')
+# 超时/中断: 服务端可能已经写入, 主键由服务端生成(auto_id)时重试会产生重复数据
+AMBIGUOUS_STATUS = ('DEADLINE_EXCEEDED', 'ABORTED')
+
+
+def _rpc_status(e: BaseException) -> str:
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if grpc is not None and isinstance(e, grpc.RpcError) and hasattr(e, 'code'):
+            return e.code().name
+        if type(e).__name__ == 'MilvusUnavailableException':
+            return 'UNAVAILABLE'
+        # pymilvus 把 gRPC 错误包装为 MilvusException, 状态名保留在消息中
+        message = str(e)
+        status = next((x for x in UNSENT_STATUS + AMBIGUOUS_STATUS if x in message), None)
+        if status:
+            return status
+        e = e.__cause__ or e.__context__
+    return ''
+
+
+def is_transient(e: BaseException, idempotent: bool = True) -> bool:
+    '''
+    可以重试的临时错误; 参数/schema等确定性错误不重试
+    idempotent: 主键由客户端指定时为True, 此时超时也可以重试(相同主键覆盖), 否则只重试确定未写入的错误
+    '''
+    if isinstance(e, ConnectionError):
+        return True
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return idempotent
+    status = _rpc_status(e)
+    return status in UNSENT_STATUS or (idempotent and status in AMBIGUOUS_STATUS)
+
+
+def as_column(column: Any) -> Any:
+    '''
+    pandas Series/pyarrow Array 转为numpy数组(数值类型不复制), numpy数组和列表原样返回
+    '''
+    if hasattr(column, 'to_numpy') and not hasattr(column, '__array_interface__'):
+        try:
+            return column.to_numpy(zero_copy_only=False)
+        except TypeError:
+            return column.to_numpy()
+    return column
+
+
+def column_batches(data: List[Any], size: int) -> Iterator[Tuple[int, list]]:
+    '''
+    按行切分列式数据, 返回 (起始行, [各列切片]); numpy数组的切片是视图, 不复制数据
+    '''
+    columns = [as_column(x) for x in data]
+    total = len(columns[0]) if columns else 0
+    assert all(len(x) == total for x in columns), "all columns must have the same length"
+    for start in range(0, total, size):
+        yield start, [x[start : start + size] for x in columns]
+
+
+class BulkInserter:
+    '''
+    分批写入向量集合: 最多 concurrency 个批次同时在途, 临时错误按 backoff 指数退避重试 retries 次, 其他错误直接失败
+    insert(columns) 为写入一个批次的协程, 返回带 insert_count 的结果
+    idempotent=False(auto_id集合)时超时不重试: 服务端可能已经写入, 重试会产生重复行
+    '''
+
+    def __init__(
+        self,
+        insert: Callable[[list], Awaitable[Any]],
+        batch_size: int = 1000,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        idempotent: bool = True,
+    ) -> None:
+        assert batch_size > 0 and concurrency > 0, "batch_size and concurrency must be positive"
+        self._insert = insert
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.idempotent = idempotent
+
+    async def write(self, data: List[Any]) -> dict:
+        '''
+        返回 {'rows', 'inserted', 'failed', 'retried', 'batches': [...]}
+        retried 为经过重试的行数, 失败批次的 error 为最后一次的异常信息
+        '''
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: List[asyncio.Task] = []
+        try:
+            for index, (start, columns) in enumerate(column_batches(data, self.batch_size)):
+                # 派发前获取信号量, 切片随在途批次逐步生成
+                await semaphore.acquire()
+                task = asyncio.ensure_future(self._write_batch(index, start, columns))
+                task.add_done_callback(lambda _: semaphore.release())
+                tasks.append(task)
+        except BaseException:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        batches = await asyncio.gather(*tasks)
+        report = {'rows': 0, 'inserted': 0, 'failed': 0, 'retried': 0}
+        for item in batches:
+            report['rows'] += item['size']
+            report['inserted'] += item['inserted']
+            report['failed'] += item['size'] - item['inserted'] if item['error'] else 0
+            report['retried'] += item['size'] if item['attempts'] > 1 else 0
+        report['batches'] = batches
+        return report
+
+    async def _write_batch(self, index: int, start: int, columns: list) -> dict:
+        begin = time.perf_counter()
+        size = len(columns[0]) if columns else 0
+        result = {'batch': index, 'start': start, 'size': size, 'inserted': 0, 'attempts': 0, 'error': None}
+        delay = self.backoff
+        while True:
+            result['attempts'] += 1
+            try:
+                ret = await self._insert(columns)
+                result['inserted'] = getattr(ret, 'insert_count', size)
+                result['error'] = None
+                break
+            except Exception as e:
+                result['error'] = str(e)
+                if result['attempts'] > self.retries or not is_transient(e, self.idempotent):
+                    logger.error(f"Insert batch={index} rows={start}-{start + size} failed after {result['attempts']} attempts: {e}")
+                    break
+                logger.warning(f"Insert batch={index} failed, retry in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+        result['elapsed'] = round(time.perf_counter() - begin, 4)
+        return result
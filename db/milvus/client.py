@@ -1,42 +1,116 @@
 # -*- coding: utf-8 -*-
 import copy
+import threading
+import time
+from typing import Optional
 from uuid import uuid4
 
 from loguru import logger
 from base.di.service_location import BaseService
-from pymilvus import db, connections, Collection, utility
+from pymilvus import db, connections, Collection, exceptions, utility
+from db.milvus.meta_cache import MetaCache
+from db.milvus.runner import MilvusRunner
+
+# 本地执行相关的配置项, 不传给 connections.connect
+RUNNER_ARGS = ('max_workers', 'max_concurrency')
+LOCAL_ARGS = RUNNER_ARGS + ('search_max_batch', 'search_max_wait', 'indexes', 'meta_refresh_interval', 'meta_negative_ttl')
 
 
 class MilvusClient(BaseService):
     def __init__(self) -> None:
         self.client = None
+        self.runner = None
+        self.meta = None
+        # 线程池中的调用可能同时首次连接, 只允许一个线程执行 connect
+        self._connect_lock = threading.Lock()
+
+    def get_runner(self) -> MilvusRunner:
+        if self.runner is None:
+            args = {k: self.__dict__[k] for k in RUNNER_ARGS if self.__dict__.get(k) is not None}
+            self.runner = MilvusRunner(self.__dict__.get('alias') or '', **args)
+        return self.runner
+
+    def get_meta(self) -> MetaCache:
+        '''
+        集合元数据缓存, 配置 meta_refresh_interval 为定期刷新间隔(秒), 0 为不定期刷新, 首次在事件循环中使用时开始刷新;
+        meta_negative_ttl 为"集合不存在"结果的缓存时间(秒)
+        '''
+        if self.meta is None:
+            interval, negative_ttl = self.meta_refresh_interval, self.meta_negative_ttl
+            self.meta = MetaCache(
+                self._list_names,
+                self._describe,
+                interval=60 if interval is None else interval,
+                negative_ttl=5 if negative_ttl is None else negative_ttl,
+            )
+        self.meta.start()
+        return self.meta
+
+    async def warm_up(self) -> dict:
+        '''
+        启动时连接并加载全部集合的元数据
+        '''
+        start = time.perf_counter()
+        meta = self.get_meta()
+        await meta.refresh()
+        return dict(meta.stats(), refresh_ms=round((time.perf_counter() - start) * 1000, 3))
+
+    async def _using(self) -> str:
+        return (await self.get_runner().run(self.get_client))._using
+
+    async def _list_names(self) -> list:
+        return await self.get_runner().run(utility.list_collections, using=await self._using())
+
+    async def _describe(self, name: str) -> Optional[dict]:
+        return await self.get_runner().run(self._describe_sync, name, await self._using())
+
+    def _describe_sync(self, name: str, using: str) -> Optional[dict]:
+        try:
+            if not utility.has_collection(name, using=using):
+                return None
+            collection = Collection(name, using=using)
+        except exceptions.SchemaNotReadyException:
+            return None
+        return {
+            "exists": True,
+            "schema": collection.schema,
+            "indexes": [{"field": x.field_name, "index_name": x.index_name, "params": x.params} for x in collection.indexes],
+            "load_state": str(utility.load_state(name, using=using)),
+        }
 
     def get_client(self) -> Collection:
         if self.client is None:
-            args = copy.deepcopy(self.__dict__)
-            args.pop("client")
-            alias = args.pop("alias", uuid4().hex)
-            db_name = args.pop("db_name", "default")
-            try:
-                connections.connect(alias=alias, **args)
-            except Exception as e:
-                logger.error(e)
-                raise e
-
-            if utility.has_collection(self.collection_name, using=alias):
-                collection = Collection(
-                    db_name,
-                    using=alias,
-                )
-            else:
-                dbs = db.list_database()
-                if db_name not in dbs:
-                    db.create_database(db_name)
-                connections.connect(alias=alias, db_name=db_name, **args)
-                collection = Collection(db_name, using=alias)
-            collection.load(_async=True)
-            utility.wait_for_loading_complete(self.coll, using=self._conn.alias)
-            db.using_database(db_name=db_name, using=alias)
-            connections._fetch_handler(alias=alias)
-            self.client = collection
+            with self._connect_lock:
+                if self.client is None:
+                    self.client = self._connect()
         return self.client
+
+    def _connect(self) -> Collection:
+        args = copy.deepcopy(
+            {k: v for k, v in self.__dict__.items() if k not in ('runner', 'meta', '_connect_lock') + LOCAL_ARGS}
+        )
+        args.pop("client")
+        alias = args.pop("alias", uuid4().hex)
+        db_name = args.pop("db_name", "default")
+        try:
+            connections.connect(alias=alias, **args)
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+        if utility.has_collection(self.collection_name, using=alias):
+            collection = Collection(
+                db_name,
+                using=alias,
+            )
+        else:
+            dbs = db.list_database()
+            if db_name not in dbs:
+                db.create_database(db_name)
+            connections.connect(alias=alias, db_name=db_name, **args)
+            collection = Collection(db_name, using=alias)
+        collection.load(_async=True)
+        utility.wait_for_loading_complete(self.coll, using=self._conn.alias)
+        db.using_database(db_name=db_name, using=alias)
+        connections._fetch_handler(alias=alias)
+        return collection
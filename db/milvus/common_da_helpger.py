@@ -1,11 +1,25 @@
 # -*- encoding: utf-8 -*-
 import asyncio
-import functools
+import time
+from uuid import uuid4
 from typing import Any, Callable, List, Dict, Optional
 from base.di.service_location import service
 from loguru import logger
-from pymilvus import CollectionSchema, utility, Collection, exceptions
+from pymilvus import CollectionSchema, utility, Collection
 from base.types import P
+from db.milvus.bulk_inserter import BulkInserter
+from db.milvus.index_spec import (
+    index_params,
+    index_spec,
+    percentile,
+    recall,
+    reference_params,
+    search_params as check_search_params,
+    tune_candidates,
+    validate_index,
+)
+from db.milvus.meta_cache import MetaCache
+from db.milvus.search_batcher import SearchBatcher
 
 
 class CommonDAHelper(object):
@@ -25,6 +39,34 @@ class CommonDAHelper(object):
         if not loop:
             loop = asyncio.get_running_loop()
         self._loop = loop
+        self._batcher = None
+        self._index = None
+
+    @property
+    def batcher(self) -> SearchBatcher:
+        '''
+        单向量检索的合并器, 服务配置 search_max_batch/search_max_wait, search_max_batch 为1时关闭合并
+        '''
+        if self._batcher is None:
+            self._batcher = SearchBatcher(
+                self._search,
+                max_batch=self._conn.search_max_batch or 64,
+                max_wait=self._conn.search_max_wait or 0.002,
+            )
+        return self._batcher
+
+    @property
+    def index(self) -> dict:
+        '''
+        当前集合的索引配置, 来自服务配置 indexes, tune_search 会更新其中的默认检索参数
+        '''
+        if self._index is None:
+            self._index = index_spec(self._conn.indexes, self.coll)
+        return self._index
+
+    @property
+    def meta(self) -> MetaCache:
+        return self._conn.get_meta()
 
     @property
     def collection(self) -> Collection:
@@ -34,19 +76,23 @@ class CommonDAHelper(object):
         return self._collection_map[self.coll]
 
     async def get_tb_info(self) -> dict:
-        if await self.exists_tb(self.coll):
-            collection = self.collection
-            return {
-                "base_info": str(collection).split("\n")[2:-1],
-                "count": collection.num_entities,
-            }
-        return {}
+        meta = await self.meta.get(self.coll)
+        if meta is None:
+            return {}
+        collection = self.collection
+        return {
+            "base_info": str(collection).split("\n")[2:-1],
+            "count": await self.async_run(lambda: collection.num_entities),
+            "indexes": meta.get("indexes"),
+            "load_state": meta.get("load_state"),
+        }
 
     async def exists_tb(self, tb_name: str) -> bool:
+        '''
+        读取元数据缓存, 缓存中没有时才访问服务端
+        '''
         try:
-            return await self.async_run(utility.has_collection, tb_name, using=self.collection._using)
-        except exceptions.SchemaNotReadyException:
-            return False
+            return await self.meta.exists(tb_name)
         except Exception as e:
             logger.error(e)
             raise e
@@ -56,12 +102,17 @@ class CommonDAHelper(object):
 
     async def rename_tb(self, old_name: str, new_name: str) -> Any:
         if await self.exists_tb(old_name):
-            return await self.async_run(
-                utility.rename_collection,
-                old_name,
-                new_name,
-                using=self.collection._using,
-            )
+            try:
+                return await self.async_run(
+                    utility.rename_collection,
+                    old_name,
+                    new_name,
+                    using=self.collection._using,
+                )
+            finally:
+                self._collection_map.pop(old_name, None)
+                self._collection_map.pop(new_name, None)
+                self.meta.invalidate(old_name, new_name)
 
     async def list_tbs(self) -> list:
         return await self.async_run(utility.list_collections, using=self.collection._using)
@@ -69,44 +120,57 @@ class CommonDAHelper(object):
     async def drop_tb(self, tb_name: str = None):
         tb_name = tb_name or self.coll
         if await self.exists_tb(tb_name):
-            self.collection.drop()
+            try:
+                await self.async_run(utility.drop_collection, tb_name, using=self.collection._using)
+            finally:
+                self._collection_map.pop(tb_name, None)
+                self.meta.set_missing(tb_name)
 
     async def create_index_tb(self, schema: Optional[CollectionSchema]) -> Collection:
         async with self._lock:
             client = self._conn.get_client()
             collection = client(name=self.coll, schema=schema, using=self._conn.alias)
             if not (await self.exists_index(collection)):
-                index_params = {
-                    "metric_type": "IP",
-                    "index_type": "IVF_FLAT",
-                    "params": {"nlist": 1000},  # 聚类个数，过大或过小损失搜索精度
-                }
                 await self.async_run(
                     collection.create_index,
-                    field_name="embedding",
-                    index_params=index_params,
+                    field_name=self.index["field"],
+                    index_params=index_params(self.index),
                 )
             await self.async_run(collection.load, _async=True)
             self._collection_map[self.coll] = collection
+            self.meta.invalidate(self.coll)
             return collection
 
-    def _batch_data(self, data: list, batch_size=100) -> list:
-        result = [[field[i : i + batch_size] for i in range(0, len(field), batch_size)] for field in data]
-        return result
-
-    async def bulk_insert(self, data: List[list], schema: Optional[CollectionSchema], bulk_size: int = 100) -> int:
+    async def bulk_insert(
+        self,
+        data: List[Any],
+        schema: Optional[CollectionSchema],
+        bulk_size: int = 1000,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ) -> dict:
+        '''
+        data: 列式数据, 每列可以是列表、numpy数组或pandas/pyarrow列, numpy数组按视图切片不复制
+        只重试临时错误; auto_id 集合超时不重试, 避免服务端已写入时产生重复行
+        返回 {'rows', 'inserted', 'failed', 'retried', 'batches', 'count'}, count 为写入后集合总行数(此前返回 num_entities)
+        '''
         if not await self.exists_tb(self.coll):
             await self.create_index_tb(schema)
         collection = self.collection
-        result = self._batch_data(data, bulk_size)
-        for batch in zip(*result):
-            try:
-                await self.async_run(collection.insert, list(batch))
-            except exceptions.MilvusException as e:
-                logger.error(f"insert data error, error_msg={e}")
-                continue
+        auto_id = await self.async_run(lambda: collection.schema.auto_id)
+        inserter = BulkInserter(
+            lambda columns: self.async_native(collection.insert, columns),
+            batch_size=bulk_size,
+            concurrency=concurrency,
+            retries=retries,
+            backoff=backoff,
+            idempotent=not auto_id,
+        )
+        report = await inserter.write(data)
         await self.async_run(collection.flush)
-        return collection.num_entities
+        report['count'] = await self.async_run(lambda: collection.num_entities)
+        return report
 
     async def query(self, expr: str, *args, **kwargs) -> list:
         if not (await self.exists_tb(self.coll)):
@@ -123,7 +187,7 @@ class CommonDAHelper(object):
             id_name = list(ids[0].keys())[0]
             ids = map(lambda x: str(x["id"]), ids)
         ids = ",".join(map(str, ids))
-        ret = await self.async_run(self.collection.delete, f"{id_name} in [{ids}]")
+        ret = await self.async_native(self.collection.delete, f"{id_name} in [{ids}]")
         await self.async_run(self.collection.flush)
         return ret.delete_count
 
@@ -138,13 +202,28 @@ class CommonDAHelper(object):
         *args: P.args,
         **kwargs: P.kwargs,
     ) -> list:
-        search_params["offset"] = offset
-        hits = await self.async_run(
+        search_params = check_search_params(self.index, search_params, limit)
+        options = dict(
+            search_params=dict(search_params, offset=offset),
+            output_fields=output_fields,
+            expr=(expr or None),
+            limit=limit,
+            **kwargs,
+        )
+        # 并发的单向量检索合并为一次多向量检索
+        if len(query_embeddings) == 1 and self.batcher.max_batch > 1:
+            return [await self.batcher.search(query_embeddings[0], **options)]
+        return await self._search(query_embeddings, **options)
+
+    async def _search(
+        self, query_embeddings: list, search_params: dict, output_fields: list, expr: str, limit: int, **kwargs: Any
+    ) -> list:
+        hits = await self.async_native(
             self.collection.search,
             query_embeddings,
-            anns_field="embedding",
+            anns_field=self.index["field"],
             param=search_params,
-            expr=(expr or None),
+            expr=expr,
             output_fields=output_fields,
             limit=limit,
             **kwargs,
@@ -158,5 +237,128 @@ class CommonDAHelper(object):
             result.append(tmp)
         return result
 
+    async def rebuild_index(self, spec: dict = None, batch_size: int = 1000, keep_old: bool = False) -> dict:
+        '''
+        在线重建索引: 按 spec(默认为配置的索引)新建集合并建索引, 从原集合分页复制数据, 加载完成后通过 rename_tb 替换;
+        替换前原集合照常提供查询, 两次重命名之间集合短暂不存在, 第二次重命名失败时把原集合改回原名;
+        复制期间写入原集合的数据不会同步, 需暂停写入或事后补写; auto_id 集合的主键会重新生成
+        '''
+        spec = validate_index(spec) if spec else self.index
+        old = self.collection
+        using = old._using
+        suffix = uuid4().hex[:8]
+        new_name, old_name = f"{self.coll}_rebuild_{suffix}", f"{self.coll}_old_{suffix}"
+        fields = [x for x in old.schema.fields if not (x.is_primary and old.schema.auto_id)]
+        start = time.perf_counter()
+        async with self._lock:
+            new = await self.async_run(Collection, new_name, schema=old.schema, using=using)
+            try:
+                await self.async_run(new.create_index, field_name=spec["field"], index_params=index_params(spec))
+                inserter = BulkInserter(
+                    lambda columns: self.async_native(new.insert, columns),
+                    batch_size=batch_size,
+                    idempotent=not old.schema.auto_id,
+                )
+                report = {"rows": 0, "inserted": 0, "failed": 0, "retried": 0}
+                iterator = await self.async_run(old.query_iterator, batch_size=batch_size, output_fields=[x.name for x in fields])
+                try:
+                    while rows := await self.async_run(iterator.next):
+                        result = await inserter.write([[row[x.name] for row in rows] for x in fields])
+                        for key in report:
+                            report[key] += result[key]
+                finally:
+                    await self.async_run(iterator.close)
+                if report["failed"]:
+                    raise Exception(f"Rebuild of {self.coll} failed to copy {report['failed']} rows")
+                await self.async_run(new.flush)
+                await self.async_run(new.load)
+            except BaseException:
+                await self.async_run(utility.drop_collection, new_name, using=using)
+                self.meta.set_missing(new_name)
+                raise
+            self.meta.invalidate(new_name)
+            renamed = False
+            try:
+                await self.rename_tb(self.coll, old_name)
+                renamed = True
+                await self.rename_tb(new_name, self.coll)
+            except BaseException:
+                logger.error(f"Swap {new_name} -> {self.coll} failed" + (f", restoring {old_name}" if renamed else ""))
+                try:
+                    if renamed:
+                        await self.rename_tb(old_name, self.coll)
+                finally:
+                    await self.async_run(utility.drop_collection, new_name, using=using)
+                    self.meta.set_missing(new_name)
+                raise
+            self._collection_map[self.coll] = await self.async_run(Collection, self.coll, using=using)
+            self._index = spec
+            if not keep_old:
+                await self.async_run(utility.drop_collection, old_name, using=using)
+                self.meta.set_missing(old_name)
+        logger.info(f"Rebuilt {self.coll} with {spec['index_type']} index in {time.perf_counter() - start:.1f}s")
+        return dict(report, index=spec, old=old_name if keep_old else None, elapsed=round(time.perf_counter() - start, 3))
+
+    async def tune_search(
+        self, queries: int = 100, limit: int = 10, target_recall: float = 0.95, apply: bool = True
+    ) -> dict:
+        '''
+        检索参数自动调优: 从集合中取 queries 条向量作为查询, 以穷举参数(IVF 扫描全部聚类)的结果为基准,
+        逐个测量候选 nprobe/ef 的召回率和延迟, 选出召回率达到 target_recall 的最快参数;
+        apply 时写入 index["search"], 之后的检索默认使用
+        '''
+        spec, collection = self.index, self.collection
+        sample = await self.async_run(collection.query, expr="", output_fields=[spec["field"]], limit=queries)
+        vectors = [x[spec["field"]] for x in sample]
+
+        async def run(params: dict) -> list:
+            param = {"metric_type": spec["metric_type"], "params": params}
+            return await self.async_native(collection.search, vectors, anns_field=spec["field"], param=param, limit=limit)
+
+        truth = [list(x.ids) for x in await run(reference_params(spec, limit))]
+        candidates = []
+        for params in tune_candidates(spec, limit):
+            latencies, recalls = [], []
+            for vector, expect in zip(vectors, truth):
+                start = time.perf_counter()
+                hits = await self.async_native(
+                    collection.search,
+                    [vector],
+                    anns_field=spec["field"],
+                    param={"metric_type": spec["metric_type"], "params": params},
+                    limit=limit,
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(recall(list(hits[0].ids), expect))
+            candidates.append(
+                {
+                    "params": params,
+                    "recall": round(sum(recalls) / len(recalls), 4) if recalls else 0,
+                    "p50_ms": round(percentile(latencies, 0.5), 3),
+                    "p95_ms": round(percentile(latencies, 0.95), 3),
+                }
+            )
+        passed = [x for x in candidates if x["recall"] >= target_recall]
+        chosen = min(passed, key=lambda x: x["p95_ms"]) if passed else max(candidates, key=lambda x: x["recall"])
+        if apply:
+            spec.setdefault("search", {}).update(chosen["params"])
+        return {
+            "index_type": spec["index_type"],
+            "queries": len(vectors),
+            "limit": limit,
+            "target_recall": target_recall,
+            "candidates": candidates,
+            "chosen": chosen,
+        }
+
     async def async_run(self, func: Callable, *args: P.args, **kwargs: P.kwargs) -> Any:
-        return await self._loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+        return await self._conn.get_runner().run(func, *args, **kwargs)
+
+    async def async_native(self, func: Callable, *args: P.args, **kwargs: P.kwargs) -> Any:
+        '''
+        支持 _async=True 的调用(search/insert/delete)使用pymilvus的future, 在服务的线程池中等待结果
+        '''
+        return await self._conn.get_runner().run_async(func, *args, **kwargs)
+
+    def runner_stats(self) -> dict:
+        return dict(self._conn.get_runner().stats(), search_batch=self.batcher.stats())
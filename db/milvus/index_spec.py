@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import copy
+from typing import Any, Dict, List, Optional
+
+# 各索引类型的构建参数(必填)和检索参数
+INDEX_TYPES: Dict[str, dict] = {
+    'FLAT': {'build': (), 'search': ()},
+    'IVF_FLAT': {'build': ('nlist',), 'search': ('nprobe',)},
+    'IVF_SQ8': {'build': ('nlist',), 'search': ('nprobe',)},
+    'IVF_PQ': {'build': ('nlist', 'm'), 'search': ('nprobe',), 'optional': ('nbits',)},
+    'HNSW': {'build': ('M', 'efConstruction'), 'search': ('ef',)},
+}
+METRIC_TYPES = ('IP', 'L2', 'COSINE')
+# 范围检索参数, 所有索引类型通用
+RANGE_PARAMS = ('radius', 'range_filter')
+
+DEFAULT_INDEX = {
+    'field': 'embedding',
+    'index_type': 'IVF_FLAT',
+    'metric_type': 'IP',
+    'params': {'nlist': 1000},  # 聚类个数，过大或过小损失搜索精度
+    'search': {'nprobe': 16},
+}
+
+
+def validate_index(spec: dict) -> dict:
+    index_type, metric_type = spec.get('index_type'), spec.get('metric_type')
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index_type {index_type}, expected one of {list(INDEX_TYPES)}")
+    if metric_type not in METRIC_TYPES:
+        raise ValueError(f"Unsupported metric_type {metric_type}, expected one of {list(METRIC_TYPES)}")
+    params, info = spec.get('params') or {}, INDEX_TYPES[index_type]
+    missing = [x for x in info['build'] if x not in params]
+    if missing:
+        raise ValueError(f"{index_type} index requires params {missing}")
+    unknown = set(params) - set(info['build']) - set(info.get('optional', ()))
+    if unknown:
+        raise ValueError(f"Unknown {index_type} index params {sorted(unknown)}")
+    return spec
+
+
+def index_spec(indexes: Optional[dict], coll: str) -> dict:
+    '''
+    服务配置 indexes: {default: {...}, <集合名>: {...}}, 集合配置覆盖default, default覆盖内置默认值
+    每项: {field, index_type, metric_type, params, search}, search 为默认检索参数
+    '''
+    indexes = indexes or {}
+    spec = copy.deepcopy(DEFAULT_INDEX)
+    for item in (indexes.get('default'), indexes.get(coll)):
+        if not item:
+            continue
+        if 'index_type' in item and item['index_type'] != spec['index_type']:
+            # 换了索引类型时内置的构建/检索参数不再适用
+            spec['params'], spec['search'] = {}, {}
+        spec.update(copy.deepcopy(item))
+    return validate_index(spec)
+
+
+def index_params(spec: dict) -> dict:
+    return {'index_type': spec['index_type'], 'metric_type': spec['metric_type'], 'params': dict(spec.get('params') or {})}
+
+
+def search_params(spec: dict, params: Optional[dict], limit: int) -> dict:
+    '''
+    校验检索参数并用索引配置补全, 返回新dict
+    '''
+    params = copy.deepcopy(params or {})
+    metric_type = params.setdefault('metric_type', spec['metric_type'])
+    if metric_type != spec['metric_type']:
+        raise ValueError(f"metric_type {metric_type} does not match index metric {spec['metric_type']}")
+    values = params.setdefault('params', {})
+    allowed = INDEX_TYPES[spec['index_type']]['search']
+    unknown = set(values) - set(allowed) - set(RANGE_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown {spec['index_type']} search params {sorted(unknown)}, expected {list(allowed)}")
+    for key in allowed:
+        if key not in values and key in (spec.get('search') or {}):
+            values[key] = spec['search'][key]
+    if 'nprobe' in values and not 1 <= values['nprobe'] <= spec['params']['nlist']:
+        raise ValueError(f"nprobe must be in [1, {spec['params']['nlist']}]")
+    if 'ef' in values and values['ef'] < limit:
+        raise ValueError(f"HNSW ef ({values['ef']}) must not be smaller than limit ({limit})")
+    return params
+
+
+def tune_candidates(spec: dict, limit: int) -> List[dict]:
+    '''
+    自动调参的候选检索参数, 按精度从低到高排列
+    '''
+    if spec['index_type'] == 'HNSW':
+        return [{'ef': x} for x in (16, 32, 64, 128, 256, 512) if x >= limit] or [{'ef': limit}]
+    if spec['index_type'] == 'FLAT':
+        return [{}]
+    nlist = spec['params']['nlist']
+    return [{'nprobe': x} for x in (1, 4, 8, 16, 32, 64, 128, 256) if x <= nlist]
+
+
+def reference_params(spec: dict, limit: int) -> dict:
+    '''
+    计算召回率基准用的穷举参数: IVF 扫描全部聚类(IVF_FLAT 即为精确结果), HNSW 使用远大于limit的ef
+    '''
+    if spec['index_type'] == 'HNSW':
+        return {'ef': max(limit * 32, 1024)}
+    if spec['index_type'] == 'FLAT':
+        return {}
+    return {'nprobe': spec['params']['nlist']}
+
+
+def recall(result: List[Any], truth: List[Any]) -> float:
+    if not truth:
+        return 1.0
+    return len(set(result) & set(truth)) / len(truth)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+
+
+_caches: List['MetaCache'] = []
+
+
+async def close_meta_caches() -> None:
+    for cache in list(_caches):
+        cache.close()
+
+
+class MetaCache:
+    '''
+    Milvus集合元数据缓存: 是否存在、schema、索引、加载状态, 按 interval 定期全量刷新;
+    list_names() 返回全部集合名, describe(name) 返回单个集合的元数据, 集合不存在时返回None
+    已存在的集合查询时不访问服务端; 不存在的结果只缓存 negative_ttl 秒, 其他进程新建的集合随后即可见
+    '''
+
+    def __init__(
+        self,
+        list_names: Callable[[], Awaitable[list]],
+        describe: Callable[[str], Awaitable[Optional[dict]]],
+        interval: float = 60,
+        negative_ttl: float = 5,
+    ) -> None:
+        self._list_names = list_names
+        self._describe = describe
+        self.interval = interval
+        self.negative_ttl = negative_ttl
+        self._data: Dict[str, dict] = {}
+        self._missing: Dict[str, float] = {}
+        self._version = 0
+        self._invalidated: Dict[str, int] = {}
+        self._task = None
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refreshed_at = None
+        _caches.append(self)
+
+    def stats(self) -> dict:
+        return {
+            'collections': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'age': round(time.monotonic() - self.refreshed_at, 3) if self.refreshed_at is not None else None,
+        }
+
+    async def get(self, name: str) -> Optional[dict]:
+        if name in self._data:
+            self.hits += 1
+            return self._data[name]
+        missing_at = self._missing.get(name)
+        if missing_at is not None and time.monotonic() - missing_at < self.negative_ttl:
+            self.hits += 1
+            return None
+        self.misses += 1
+        version = self._version
+        meta = await self._describe(name)
+        # 查询期间被失效的结果不缓存
+        if self._invalidated.get(name, -1) <= version:
+            self._store(name, meta)
+        return meta
+
+    def _store(self, name: str, meta: Optional[dict]) -> None:
+        if meta is None:
+            self._data.pop(name, None)
+            self._missing[name] = time.monotonic()
+        else:
+            self._data[name] = meta
+            self._missing.pop(name, None)
+
+    async def exists(self, name: str) -> bool:
+        return await self.get(name) is not None
+
+    async def refresh(self) -> None:
+        version = self._version
+        names = await self._list_names()
+        metas = await asyncio.gather(*[self._describe(x) for x in names], return_exceptions=True)
+        data = {}
+        for name, meta in zip(names, metas):
+            if isinstance(meta, BaseException):
+                logger.opt(exception=meta).warning(f"Describe milvus collection {name} failed")
+                meta = {'exists': True}
+            data[name] = meta
+        for name in [x for x, v in self._invalidated.items() if v > version]:
+            data.pop(name, None)
+        for name in data:
+            self._missing.pop(name, None)
+        self._data = data
+        self._invalidated = {x: v for x, v in self._invalidated.items() if v > version}
+        self.refreshes += 1
+        self.refreshed_at = time.monotonic()
+
+    def invalidate(self, *names: str) -> None:
+        '''
+        集合被创建/重命名/建索引后调用, 下次查询时重新获取
+        '''
+        self._version += 1
+        for name in names:
+            self._data.pop(name, None)
+            self._missing.pop(name, None)
+            self._invalidated[name] = self._version
+
+    def set_missing(self, name: str) -> None:
+        self.invalidate(name)
+        self._store(name, None)
+
+    def start(self) -> None:
+        '''
+        开始定期刷新, 已启动、已关闭或不在事件循环中时不做处理
+        '''
+        if self._task is not None or self._closed or not self.interval:
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+        except RuntimeError:
+            pass
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.warning("Refresh milvus metadata failed", exc_info=True)
+
+    def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self in _caches:
+            _caches.remove(self)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+from base.types import P
+
+
+_runners: List['MilvusRunner'] = []
+
+
+def shutdown_runners() -> None:
+    for runner in list(_runners):
+        runner.shutdown()
+
+
+class MilvusRunner:
+    '''
+    每个Milvus服务独立的线程池, max_concurrency 限制同时执行的调用数, 超出的调用在协程中排队
+    '''
+
+    def __init__(self, name: str = '', max_workers: int = 8, max_concurrency: int = 32) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'milvus-{name}')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        _runners.append(self)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def stats(self) -> dict:
+        total = self.completed + self.failed
+        return {
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'in_flight': self.in_flight,
+            'executor_queue': self._executor._work_queue.qsize(),
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_ms': round(self.wait_time * 1000 / total, 3) if total else 0,
+            'avg_run_ms': round(self.run_time * 1000 / total, 3) if total else 0,
+        }
+
+    async def run(self, func: Callable, *args: P.args, **kwargs: P.kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await self._limit(lambda: loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs)))
+
+    async def run_async(self, func: Callable, *args: P.args, **kwargs: P.kwargs) -> Any:
+        '''
+        func 需支持 _async=True 并返回future, 如 Collection.search/insert/delete;
+        pymilvus 的 future.done() 会阻塞等待结果, 不能在事件循环中轮询, 发起请求和 result() 一起在线程池中执行
+        '''
+        return await self.run(lambda: func(*args, _async=True, **kwargs).result())
+
+    async def _limit(self, call: Callable) -> Any:
+        start = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        began = time.perf_counter()
+        self.wait_time += began - start
+        self.in_flight += 1
+        try:
+            result = await call()
+            self.completed += 1
+            return result
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.run_time += time.perf_counter() - began
+            self.semaphore.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+        if self in _runners:
+            _runners.remove(self)
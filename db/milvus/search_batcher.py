@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from loguru import logger
+from base.coroutine.key_builder import canonical_encode
+from base.util.wraps import spawn
+
+
+class SearchBatcher:
+    '''
+    合并并发的单向量检索: 检索参数/expr/输出字段相同的请求在 max_wait 秒内聚合, 达到 max_batch 立即提交,
+    以一次多向量 search 执行后按顺序把结果分给各调用方
+    search(vectors, **options) -> 每个向量对应一个结果列表
+    '''
+
+    def __init__(self, search: Callable[..., Awaitable[list]], max_batch: int = 64, max_wait: float = 0.002) -> None:
+        self._search = search
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._groups: Dict[bytes, dict] = {}
+        self.requests = 0
+        self.batches = 0
+        self.max_size = 0
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'avg_batch': round(self.requests / self.batches, 2) if self.batches else 0,
+            'max_batch': self.max_size,
+            'pending': sum(len(x['items']) for x in self._groups.values()),
+        }
+
+    async def search(self, vector: Any, **options: Any) -> list:
+        loop = asyncio.get_running_loop()
+        key = canonical_encode(options)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = {
+                'options': options,
+                'items': [],
+                'timer': loop.call_later(self.max_wait, self._flush, key),
+            }
+        future = loop.create_future()
+        group['items'].append((vector, future))
+        self.requests += 1
+        if len(group['items']) >= self.max_batch:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: bytes) -> None:
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        group['timer'].cancel()
+        spawn(self._run(group), "batched search")
+
+    async def _run(self, group: dict) -> None:
+        items = group['items']
+        self.batches += 1
+        self.max_size = max(self.max_size, len(items))
+        try:
+            result = await self._search([x[0] for x in items], **group['options'])
+        except Exception as e:
+            logger.warning(f"Batched search of {len(items)} vectors failed: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(items):
+            # 调用方已取消的请求直接丢弃结果
+            if not future.done():
+                future.set_result(result[i] if i < len(result) else [])
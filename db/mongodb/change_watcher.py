@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from bson import json_util
+from loguru import logger
+from pymongo.errors import OperationFailure, PyMongoError
+from base.di.service_location import service
+from base.util.wraps import spawn
+from db.cache_helper import invalidate_tags
+
+
+_watchers: List['ChangeWatcher'] = []
+
+# resume token 已超出 oplog 范围
+CHANGE_STREAM_HISTORY_LOST = (286, 280)
+
+
+async def start_watchers() -> None:
+    '''
+    App 启动时在导入路由之后调用, 之后新建的 watcher 需自行调用 start()
+    '''
+    for watcher in list(_watchers):
+        try:
+            await watcher.start()
+        except Exception:
+            logger.error(f"Error starting change watcher {watcher.name}", exc_info=True)
+
+
+async def close_watchers() -> None:
+    for watcher in list(_watchers):
+        try:
+            await watcher.close()
+        except Exception:
+            logger.error(f"Error closing change watcher {watcher.name}", exc_info=True)
+
+
+class MaterializedView:
+    '''
+    小集合的内存视图, 按key索引整表数据, 由变更事件增量更新
+    '''
+
+    def __init__(self, dao: Any, key: str = 'id') -> None:
+        self.dao = dao
+        self.key = key
+        self.data: Dict[Any, dict] = {}
+        self._ids: Dict[Any, Any] = {}
+        self.loaded = asyncio.Event()
+
+    async def load(self) -> None:
+        data, ids = {}, {}
+        async for item in (await self.dao.collection).find({}):
+            ids[item['_id']] = item.get(self.key)
+            data[item.get(self.key)] = self._strip(item)
+        self.data, self._ids = data, ids
+        self.loaded.set()
+
+    def clear(self) -> None:
+        self.data, self._ids = {}, {}
+
+    def apply(self, change: dict) -> None:
+        if change['operationType'] in ('drop', 'rename', 'dropDatabase'):
+            # 集合已删除或改名, 视图不再有数据
+            self.clear()
+            return
+        _id = change.get('documentKey', {}).get('_id')
+        document = change.get('fullDocument')
+        if change['operationType'] in ('insert', 'update', 'replace') and document is not None:
+            old = self._ids.get(_id)
+            if old is not None and old != document.get(self.key):
+                self.data.pop(old, None)
+            self._ids[_id] = document.get(self.key)
+            self.data[document.get(self.key)] = self._strip(document)
+        elif change['operationType'] in ('delete', 'update', 'replace'):
+            # update 时 fullDocument 为空说明文档已被删除
+            self.data.pop(self._ids.pop(_id, None), None)
+
+    def _strip(self, document: dict) -> dict:
+        return {k: v for k, v in document.items() if k != '_id'}
+
+    def get(self, key: Any, default: Any = None) -> Optional[dict]:
+        return self.data.get(key, default)
+
+    def values(self) -> List[dict]:
+        return list(self.data.values())
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class ChangeWatcher:
+    '''
+    基于 MongodbClient.get_client 的 change stream, 一个连接上的所有已注册集合共用一个stream:
+    变更事件使对应集合的缓存tag失效(合并后批量写入), 可额外删除指定缓存key, 并增量维护内存视图;
+    resume token 定期保存到 store 指定的缓存, 重启后从断点继续, 只失效期间真正变更过的集合;
+    App 启动时统一 start, 启动后新建的 watcher 需自行调用 start()
+    '''
+
+    def __init__(
+        self, name: str = 'db.default', store: str = 'cache.default', interval: float = 0.1, save_interval: float = 1
+    ) -> None:
+        self.name = name
+        self.store = store
+        self.interval = interval
+        self.save_interval = save_interval
+        self._tags: Dict[Tuple[str, str], List[str]] = {}
+        self._keys: Dict[Tuple[str, str], List[Tuple[str, Union[list, Callable]]]] = {}
+        self._views: Dict[Tuple[str, str], List[MaterializedView]] = {}
+        self._pending_tags: set = set()
+        self._pending_keys: Dict[str, set] = {}
+        self._token = None
+        self._saved_token = None
+        self._saved_at = 0.0
+        self._task = None
+        self._flusher = None
+        self.events = 0
+        self.invalidations = 0
+        self.restarts = 0
+        _watchers.append(self)
+
+    @property
+    def token_key(self) -> str:
+        return f'change_stream:{self.name}'
+
+    def stats(self) -> dict:
+        return {
+            'events': self.events,
+            'invalidations': self.invalidations,
+            'restarts': self.restarts,
+            'collections': len(set(self._tags) | set(self._keys) | set(self._views)),
+            'views': {f'{db}.{coll}': [len(x) for x in views] for (db, coll), views in self._views.items()},
+        }
+
+    def register(
+        self, dao: Any, tags: List[str] = None, keys: Union[list, Callable[[dict], list]] = None, cache: str = None
+    ) -> None:
+        '''
+        tags: 集合变更时失效的tag, 默认为dao的集合tag
+        keys: 变更时从cache删除的缓存key, 可以是列表或 keys(change) -> list
+        '''
+        ns = (dao.db, dao.coll)
+        self._tags.setdefault(ns, [])
+        for tag in tags or [dao.tag]:
+            if tag not in self._tags[ns]:
+                self._tags[ns].append(tag)
+        if keys is not None:
+            self._keys.setdefault(ns, []).append((cache or 'cache.default', keys))
+        self._restart()
+
+    def view(self, dao: Any, key: str = 'id') -> MaterializedView:
+        view = MaterializedView(dao, key)
+        self._views.setdefault((dao.db, dao.coll), []).append(view)
+        if self._task is not None:
+            spawn(view.load(), f"load view {dao.tag}")
+        self._restart()
+        return view
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._token = await self._load_token()
+        self._task = asyncio.ensure_future(self._run())
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+
+    def _restart(self) -> None:
+        # 运行中注册了新集合, 从当前断点重新打开stream
+        if self._task is not None:
+            self._task.cancel()
+            self._task = asyncio.ensure_future(self._run(load_views=False))
+
+    async def close(self) -> None:
+        tasks = [x for x in (self._task, self._flusher) if x is not None]
+        for task in tasks:
+            task.cancel()
+        # 等待取消完成, 被中断的失效操作已放回待处理队列
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._flusher = None
+        await self._flush()
+        await self._save_token(force=True)
+        if self in _watchers:
+            _watchers.remove(self)
+
+    async def _run(self, load_views: bool = True) -> None:
+        delay = 1
+        while True:
+            try:
+                client = await service.get(self.name).get_client()
+                namespaces = [{'db': db, 'coll': coll} for db, coll in set(self._tags) | set(self._keys) | set(self._views)]
+                dbs = list({x['db'] for x in namespaces})
+                # dropDatabase 事件的 ns 只有 db
+                dropped = {'operationType': 'dropDatabase', 'ns.db': {'$in': dbs}}
+                pipeline = [{'$match': {'$or': [{'ns': {'$in': namespaces}}, dropped]}}]
+                options = {'full_document': 'updateLookup'} if self._views else {}
+                if self._token is not None:
+                    options['resume_after'] = self._token
+                async with client.watch(pipeline, **options) as stream:
+                    if load_views:
+                        # stream打开后再加载视图, 加载期间的变更随后按事件补齐
+                        await asyncio.gather(*[x.load() for views in self._views.values() for x in views])
+                        load_views = False
+                    delay = 1
+                    async for change in stream:
+                        self._apply(change)
+                        self._token = stream.resume_token
+                        await self._save_token()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code not in CHANGE_STREAM_HISTORY_LOST:
+                    logger.error(f"Change stream {self.name} failed", exc_info=True)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60)
+                    continue
+                # 断点已不在oplog中, 期间的变更无法得知, 只能整体失效并重新加载
+                logger.warning(f"Change stream {self.name} resume token lost, invalidating all")
+                self._token = None
+                self.restarts += 1
+                self._pending_tags.update(x for tags in self._tags.values() for x in tags)
+                # 视图在新stream打开后重新加载, 否则加载与打开之间的变更会丢失
+                load_views = True
+            except PyMongoError:
+                logger.error(f"Change stream {self.name} disconnected", exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _apply(self, change: dict) -> None:
+        self.events += 1
+        ns = change.get('ns', {})
+        if change.get('operationType') == 'dropDatabase':
+            targets = [x for x in set(self._tags) | set(self._keys) | set(self._views) if x[0] == ns.get('db')]
+        else:
+            targets = [(ns.get('db'), ns.get('coll'))]
+        for ns in targets:
+            self._pending_tags.update(self._tags.get(ns, []))
+            for cache, keys in self._keys.get(ns, []):
+                try:
+                    self._pending_keys.setdefault(cache, set()).update(keys(change) if callable(keys) else keys)
+                except Exception:
+                    logger.warning(f"Error building cache keys from change on {ns}", exc_info=True)
+            for view in self._views.get(ns, []):
+                view.apply(change)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._flush()
+
+    async def _flush(self) -> bool:
+        tags, self._pending_tags = self._pending_tags, set()
+        keys, self._pending_keys = self._pending_keys, {}
+        try:
+            if tags:
+                await invalidate_tags(sorted(tags))
+                self.invalidations += len(tags)
+            for cache, items in keys.items():
+                await service.get(cache).delete_many(sorted(items))
+                self.invalidations += len(items)
+        except asyncio.CancelledError:
+            # 被 close/_restart 取消, 放回队列由下一次刷新处理, 失效是幂等的
+            self._requeue(tags, keys)
+            raise
+        except Exception:
+            logger.error(f"Change stream {self.name} invalidation failed", exc_info=True)
+            self._requeue(tags, keys)
+            return False
+        return True
+
+    def _requeue(self, tags: set, keys: Dict[str, set]) -> None:
+        self._pending_tags |= tags
+        for cache, items in keys.items():
+            self._pending_keys.setdefault(cache, set()).update(items)
+
+    async def _load_token(self) -> Any:
+        try:
+            value = await service.get(self.store).get(self.token_key)
+            return json_util.loads(value) if value else None
+        except Exception:
+            logger.warning(f"Error loading resume token {self.token_key}", exc_info=True)
+            return None
+
+    async def _save_token(self, force: bool = False) -> None:
+        if self._token is None or self._token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._saved_at < self.save_interval:
+            return
+        # 先完成失效再保存断点, 保证断点之前的变更都已生效
+        if not await self._flush():
+            return
+        try:
+            await service.get(self.store).set(self.token_key, json_util.dumps(self._token).encode('utf-8'))
+            self._saved_token, self._saved_at = self._token, time.monotonic()
+        except Exception:
+            logger.warning(f"Error saving resume token {self.token_key}", exc_info=True)
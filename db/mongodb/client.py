@@ -1,27 +1,55 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import copy
+import time
 from typing import AsyncGenerator
 from motor.motor_asyncio import AsyncIOMotorClient
-from base.coroutine.shared import shared
-from base.di.service_location import BaseService
+from base.coroutine.single_flight import single_flight
+from base.di.service_location import BaseService, service
 from base.util.wraps import event
 from db.mongodb.events import sshforward_event
+from db.mongodb.helper.pool_stats import PoolStats
 
 
 class MongodbClient(BaseService):
     def __init__(self) -> None:
         self.client = None
+        self.pool_stats = PoolStats()
 
     async def get_client(self) -> AsyncGenerator:
         if self.client is None:
 
-            @shared(self.__dict__.get('url'))
+            @single_flight(self.__dict__.get('url'))
             @event(sshforward_event, param=self.__dict__)
             async def run() -> AsyncGenerator:
-                args = copy.deepcopy(self.__dict__)
+                args = copy.deepcopy({k: v for k, v in self.__dict__.items() if k not in ('client', 'pool_stats')})
                 url = args.pop('url')
-                args.pop('client', None)
+                args['event_listeners'] = list(args.get('event_listeners') or []) + [self.pool_stats]
                 return AsyncIOMotorClient(url, **args)
 
             self.client = await run()
         return self.client
+
+    async def warm_up(self) -> dict:
+        '''
+        启动时预热: 创建客户端(ssh隧道/DNS/服务器选择), ping 并预先打开 minPoolSize 个连接
+        '''
+        start = time.perf_counter()
+        client = await self.get_client()
+        await client.admin.command('ping')
+        ping = time.perf_counter() - start
+        size = client.options.pool_options.min_pool_size
+        if size > 1:
+            # 并发请求迫使连接池同时建立多个连接
+            await asyncio.gather(*[client.admin.command('ping') for _ in range(size)])
+        return {'ping_ms': round(ping * 1000, 3), 'min_pool_size': size, 'pools': self.pool_stats.snapshot()}
+
+    def stats(self) -> dict:
+        return self.pool_stats.snapshot()
+
+
+def pool_stats() -> dict:
+    '''
+    所有已创建的Mongo客户端的连接池统计, 按服务名和服务器地址分组
+    '''
+    return {name: x.stats() for name, x in service.sl_map.items() if isinstance(x, MongodbClient)}
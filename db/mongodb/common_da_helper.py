@@ -1,18 +1,36 @@
 # -*- coding: utf-8 -*-
 
-from typing import Any, AsyncGenerator, List, Union
+import asyncio
+import time
+from typing import Any, AsyncGenerator, AsyncIterable, Iterable, List, Optional, Union
 from async_property import async_property
+from loguru import logger
 
 from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from base.di.service_location import service
 from base.coroutine.context import context
+from base.util.wraps import spawn
 from db.base_model import BaseModel
-from db.cache_helper import cache
+from db.cache_helper import cache, invalidate_tags, tag_store
 
 from db.da_interface import DaInterface
+from db.mongodb.helper.bulk_helper import BulkWriter
+from db.mongodb.helper.data_loader import DataLoader
+from db.mongodb.helper.index_advisor import AGGREGATE, COUNT, FIND, index_advisor
+from db.mongodb.helper.keyset_helper import decode_cursor, encode_cursor, keyset_match, keyset_sort
+from db.mongodb.helper.pipeline_optimizer import match_fields, optimize_pipeline, unindexed_match
+from db.mongodb.helper.write_buffer import WriteBuffer
 
 
 class CommonDAHelper(DaInterface):
+    COUNT_EXACT = 'exact'
+    COUNT_ESTIMATED = 'estimated'
+    COUNT_CAPPED = 'capped'
+    COUNT_CACHED = 'cached'
+    COUNT_LAZY = 'lazy'
+    COUNT_NONE = 'none'
+
     @property
     def session(self) -> Any:
         return context.get('mongo_session')
@@ -21,26 +39,70 @@ class CommonDAHelper(DaInterface):
     async def collection(self) -> AsyncGenerator:
         return (await service.get(self.name).get_client())[self.db][self.coll]
 
-    def __init__(self, db: str, coll: str, name: str = 'db.default') -> None:
+    @property
+    def tag(self) -> str:
+        return f'{self.db}.{self.coll}'
+
+    @property
+    def projection(self) -> dict:
+        return self.model.projection() if self.model is not None else {}
+
+    def __init__(self, db: str, coll: str, name: str = 'db.default', model: BaseModel = None) -> None:
         self.name = name
+        self.model = model
         self.db = db
         self.coll = coll
         self.id_generator = service.id_generator
+        self.buffer = None
+        self.loader = DataLoader(self)
+        self._indexed = None
+        self._checked = set()
+
+    def load_model(self, data: dict) -> BaseModel:
+        return (self.model.copy() if self.model is not None else BaseModel()).load(data)
+
+    def _project(self, pipeline: List, keep: List[str] = ()) -> dict:
+        # 只有过滤/排序/分页阶段时文档结构未变, 才能按模型声明的字段投影
+        if self.projection and all(next(iter(x)) in ('$match', '$sort', '$skip', '$limit') for x in pipeline):
+            projection = dict(self.projection, _id=False)
+            for key in keep:
+                # keep 为必须返回的字段(如游标分页的排序字段), 已包含父字段时不重复添加, 避免路径冲突
+                if any(v and (key == k or key.startswith(f'{k}.')) for k, v in projection.items()):
+                    continue
+                projection = {k: v for k, v in projection.items() if not k.startswith(f'{key}.')}
+                projection[key] = True
+            return projection
+        return {'_id': False}
+
+    def cached(self, cached: dict) -> dict:
+        # 未配置tag存储时不加集合tag, 缓存只按过期时间失效
+        if tag_store() is None:
+            return cached
+        return dict(cached, tags=list(cached.get('tags') or []) + [self.tag])
+
+    async def invalidate(self) -> None:
+        self.loader.clear()
+        try:
+            await invalidate_tags([self.tag])
+        except Exception:
+            logger.warning(f"Error invalidating cache tag={self.tag}", exc_info=True)
 
     async def updateAll(self, data: dict, matcher: dict) -> int:
-        return (await (await self.collection).update_many(matcher, {'$set': data})).modified_count
+        result = (await (await self.collection).update_many(matcher, {'$set': data})).modified_count
+        await self.invalidate()
+        return result
 
     async def save(
         self, model: Union[BaseModel, dict], matcher: dict = None, projection: dict = {}, upsert: bool = True, more_update={}
     ) -> dict:
         if isinstance(model, dict):
-            model = BaseModel().load(model)
+            model = self.load_model(model)
         tmp = model.to_dict()
         data = model.data
         if matcher is None:
             matcher = {model.key: tmp.get(model.key)}
-        projection.update({"_id": False})
-        return await (await self.collection).find_one_and_update(
+        projection = dict(projection or self.projection, _id=False)
+        result = await (await self.collection).find_one_and_update(
             matcher,
             dict(more_update, **{"$set": data, '$setOnInsert': dict(filter(lambda x: x[0] not in data, tmp.items()))}),
             return_document=ReturnDocument.AFTER,
@@ -48,72 +110,179 @@ class CommonDAHelper(DaInterface):
             projection=projection,
             session=self.session,
         )
+        await self.invalidate()
+        return result
+
+    def write_buffer(self, max_ops: int = 1000, max_pending: int = 10000, interval: float = 1) -> WriteBuffer:
+        if self.buffer is None:
+            self.buffer = WriteBuffer(self, max_ops, max_pending, interval)
+        return self.buffer
+
+    async def save_buffered(
+        self, model: Union[BaseModel, dict], matcher: dict = None, upsert: bool = True, wait: bool = False
+    ) -> asyncio.Future:
+        '''
+        写缓冲保存, 同一个matcher的多次保存合并为一次写入; 返回写入完成的Future, wait=True时等待落库
+        '''
+        if isinstance(model, dict):
+            model = self.load_model(model)
+        tmp = model.to_dict()
+        data = model.data
+        if matcher is None:
+            matcher = {model.key: tmp.get(model.key)}
+        return await self.write_buffer().save(matcher, data, tmp, upsert, wait)
+
+    def update_op(self, model: Union[BaseModel, dict], matcher: list = None, upsert: bool = True) -> UpdateOne:
+        if isinstance(model, dict):
+            model = self.load_model(model)
+        tmp = model.to_dict()
+        data = model.data
+        if matcher is None:
+            condition = {model.key: tmp.get(model.key)}
+        else:
+            condition = {}
+            for key in matcher:
+                condition.update({key: data.get(key)})
+        return UpdateOne(
+            condition,
+            {"$set": data, '$setOnInsert': dict(filter(lambda x: x[0] not in data, tmp.items()))},
+            upsert=upsert,
+        )
 
     async def batch_save(self, models: list[Union[BaseModel, dict]], matcher: list = None, upsert: bool = True) -> int:
-        bulk_write_data = []
-        for model in models:
-            if isinstance(model, dict):
-                model = BaseModel().load(model)
-            tmp = model.to_dict()
-            data = model.data
-            if matcher is None:
-                condition = {model.key: tmp.get(model.key)}
-            else:
-                condition = {}
-                for key in matcher:
-                    condition.update({key: data.get(key)})
-            bulk_write_data.append(
-                UpdateOne(
-                    condition,
-                    {"$set": data, '$setOnInsert': dict(filter(lambda x: x[0] not in data, tmp.items()))},
-                    upsert=upsert,
-                )
+        report = await self.bulk_save(models, matcher, upsert)
+        # 网络等异常原样抛出, 写入错误合并为pymongo格式的 BulkWriteError
+        exception = next((x['exception'] for x in report['chunks'] if x['exception'] is not None), None)
+        if exception is not None:
+            raise exception
+        if report['errors']:
+            raise BulkWriteError(
+                {
+                    'writeErrors': [x for chunk in report['chunks'] for x in chunk['write_errors']],
+                    'writeConcernErrors': [x for chunk in report['chunks'] for x in chunk['write_concern_errors']],
+                    'nInserted': report['inserted'],
+                    'nUpserted': report['upserted'],
+                    'nMatched': report['matched'],
+                    'nModified': report['modified'],
+                    'nRemoved': report['deleted'],
+                    'upserted': [],
+                }
             )
+        return report['inserted'] + report['modified']
 
-        result = await (await self.collection).bulk_write(bulk_write_data, session=self.session)
-        return result.inserted_count + result.modified_count
+    async def bulk_save(
+        self,
+        models: Union[Iterable, AsyncIterable],
+        matcher: list = None,
+        upsert: bool = True,
+        chunk_size: int = 1000,
+        concurrency: int = 4,
+        ordered: bool = False,
+    ) -> dict:
+        '''
+        models: 列表或(异步)迭代器, 按chunk_size分块转换并提交, 导入时不需要一次性加载全部数据
+        返回每块的写入结果和错误, 单块失败不影响其他块
+        '''
+        writer = BulkWriter(await self.collection, chunk_size, concurrency, ordered, self.session)
+        try:
+            return await writer.write(models, lambda x: self.update_op(x, matcher, upsert))
+        finally:
+            await self.invalidate()
 
     async def get(self, id: Any = None, matcher: dict = {}, projection: dict = {}, sort: list = [], **kwargs) -> dict:
         if id:
             matcher.update({"id": id})
         if not matcher:
             return {}
-        projection.update({"_id": False})
-        return (await (await self.collection).find_one(matcher, projection=projection, sort=sort, **kwargs)) or {}
+        projection = dict(projection or self.projection, _id=False)
+        start = time.perf_counter()
+        result = await (await self.collection).find_one(matcher, projection=projection, sort=sort, **kwargs)
+        self.observe(FIND, {'filter': matcher, 'sort': sort}, start)
+        return result or {}
+
+    async def load(self, id: Any) -> dict:
+        '''
+        按id批量合并查询, 同一个事件循环tick内的并发调用合并为一次 $in 查询
+        '''
+        return await self.loader.load(id)
+
+    async def load_many(self, ids: List[Any]) -> List[dict]:
+        return await self.loader.load_many(ids)
 
     async def list(
         self, matcher: dict = {}, projection: dict = {}, page: int = 1, page_size: int = 0, sort=[], **kwargs
     ) -> List:
         page = page if page > 0 else 1
-        projection.update({"_id": False})
-        return (
+        projection = dict(projection or self.projection, _id=False)
+        start = time.perf_counter()
+        result = (
             await (await self.collection)
             .find(matcher, projection=projection, sort=sort, **kwargs)
             .skip(page_size * (page - 1))
             .limit(page_size)
             .to_list(length=None)
         )
+        self.observe(FIND, {'filter': matcher, 'sort': sort}, start)
+        return result
+
+    async def stream(
+        self, matcher: dict = {}, projection: dict = {}, sort=[], batch_size: int = 1000, batched: bool = False, **kwargs
+    ) -> AsyncGenerator:
+        cursor = (await self.collection).find(
+            matcher, projection=dict(projection or self.projection, _id=False), sort=sort, batch_size=batch_size, session=self.session, **kwargs
+        )
+        async for item in self._iterate(cursor, batch_size, batched):
+            yield item
+
+    async def iter_query(
+        self, pipeline: List = [], sort={}, batch_size: int = 1000, batched: bool = False, **kwargs
+    ) -> AsyncGenerator:
+        pipeline = pipeline + ([{'$sort': sort}] if sort else [])
+        pipeline.append({'$project': self._project(pipeline)})
+        cursor = (await self.collection).aggregate(pipeline, batchSize=batch_size, session=self.session, **kwargs)
+        async for item in self._iterate(cursor, batch_size, batched):
+            yield item
+
+    async def _iterate(self, cursor: Any, batch_size: int, batched: bool) -> AsyncGenerator:
+        if not batched:
+            async for document in cursor:
+                yield document
+            return
+        while True:
+            batch = await cursor.to_list(length=batch_size)
+            if not batch:
+                break
+            yield batch
 
     async def count(self, matcher: dict = {}) -> int:
-        return await (await self.collection).count_documents(matcher)
+        start = time.perf_counter()
+        result = await (await self.collection).count_documents(matcher)
+        self.observe(COUNT, {'filter': matcher}, start)
+        return result
 
     async def delete(self, id: Any = None, matcher: dict = {}) -> int:
         if id is not None:
             matcher.update({"id": id})
         if not matcher:
             return
-        return (await (await self.collection).delete_one(matcher)).deleted_count
+        result = (await (await self.collection).delete_one(matcher)).deleted_count
+        await self.invalidate()
+        return result
 
     async def deleteAll(self, matcher: dict) -> int:
         if not matcher:
             return
-        return (await (await self.collection).delete_many(matcher)).deleted_count
+        result = (await (await self.collection).delete_many(matcher)).deleted_count
+        await self.invalidate()
+        return result
 
     async def batch_delete(self, matcher: dict = {}) -> int:
-        return (await (await self.collection).delete_many(matcher)).deleted_count
+        result = (await (await self.collection).delete_many(matcher)).deleted_count
+        await self.invalidate()
+        return result
 
     async def sample(self, sample: int, matcher: dict = {}, projection: dict = {}, sort: List = []) -> List:
-        projection.update({"_id": False})
+        projection = dict(projection or self.projection, _id=False)
         param = []
         if matcher:
             param.append({'$match': matcher})
@@ -127,19 +296,55 @@ class CommonDAHelper(DaInterface):
     async def distinct(self, key: str, matcher: dict = {}, cached: dict = None) -> List:
         if cached:
 
-            @cache(**cached)
+            @cache(**self.cached(cached))
             async def query(key: str, matcher: dict) -> List:
                 return await (await self.collection).find(matcher).distinct(key)
 
             return await query(key, matcher)
         return await (await self.collection).find(matcher).distinct(key)
 
-    async def index(self, param: List = [], page: int = 1, page_size: int = 20, sort={}, cached: dict = None) -> dict:
+    async def index(
+        self,
+        param: List = [],
+        page: int = 1,
+        page_size: int = 20,
+        sort={},
+        cached: dict = None,
+        cursor: str = None,
+        with_total: bool = False,
+        count: str = 'exact',
+        count_cached: dict = None,
+        optimize: bool = True,
+    ) -> dict:
+        if cursor is not None:
+            return await self.keyset(param, cursor, page_size, sort, with_total, cached, optimize)
+        if count != self.COUNT_EXACT:
+            result = {
+                'records': await self.query(
+                    list(param), sort=sort, page=page, page_size=page_size, cached=cached, optimize=optimize
+                )
+            }
+            if count == self.COUNT_LAZY:
+                # 先返回记录, 后台预热count缓存, 客户端再通过count接口获取总数
+                spawn(self.count_query(list(param), cached=count_cached, count=self.COUNT_CACHED), f"count {self.tag}")
+                result['total'] = None
+            elif count == self.COUNT_NONE:
+                result['total'] = None
+            else:
+                result['total'] = await self.count_query(list(param), cached=count_cached, count=count)
+            return result
         if sort:
             param.append({'$sort': sort})
-        records = [{'$project': {'_id': False}}, {'$skip': page_size * (page - 1)}]
-        if page_size > 0:
-            records.append({'$limit': page_size})
+        if optimize:
+            # 先分页再投影, 投影只作用于当前页
+            param = optimize_pipeline(param)
+            records = [{'$skip': page_size * (page - 1)}] if page > 1 else []
+            records += [{'$limit': page_size}] if page_size > 0 else []
+            records.append({'$project': self._project(param)})
+        else:
+            records = [{'$project': self._project(param)}, {'$skip': page_size * (page - 1)}]
+            if page_size > 0:
+                records.append({'$limit': page_size})
         param.append(
             {
                 '$facet': {
@@ -156,28 +361,133 @@ class CommonDAHelper(DaInterface):
                 }
             }
         )
-        return ((await self.query(param, cached=cached)) or [{'records': [], 'total': 0}]).pop(0)
+        return ((await self.query(param, cached=cached, optimize=optimize)) or [{'records': [], 'total': 0}]).pop(0)
+
+    async def keyset(
+        self,
+        param: List = [],
+        cursor: str = '',
+        page_size: int = 20,
+        sort={},
+        with_total: bool = False,
+        cached: dict = None,
+        optimize: bool = True,
+    ) -> dict:
+        sort = keyset_sort(sort)
+        pipeline = list(param)
+        if cursor:
+            pipeline.append({'$match': keyset_match(sort, decode_cursor(sort, cursor))})
+        records = await self.query(
+            pipeline,
+            sort=sort,
+            page_size=page_size + 1 if page_size > 0 else 0,
+            cached=cached,
+            optimize=optimize,
+            keep=list(sort),
+        )
+        result = {'records': records, 'next': None}
+        if page_size > 0 and len(records) > page_size:
+            result['records'] = records[:page_size]
+            result['next'] = encode_cursor(sort, records[page_size - 1])
+        if with_total:
+            result['total'] = await self.count_query(list(param), cached=cached)
+        return result
 
     def default_query(self, matcher: dict) -> dict:
         return [{'$match': matcher}]
 
-    async def count_query(self, param: List, cached: dict = None) -> int:
+    async def count_query(self, param: List, cached: dict = None, count: str = 'exact', cap: int = 10000) -> Union[int, str]:
+        '''
+        count: exact 精确计数; estimated 无条件时使用集合元数据估算; capped 最多数到cap, 超过返回 "cap+";
+        cached 按条件缓存计数, 过期后后台刷新(不随写入失效)
+        '''
+        match count:
+            case self.COUNT_ESTIMATED if not param or param == [{'$match': {}}]:
+                return await (await self.collection).estimated_document_count()
+            case self.COUNT_CAPPED:
+                total = await self.count_query(list(param) + [{'$limit': cap + 1}], cached=cached)
+                return f'{cap}+' if total > cap else total
+            case self.COUNT_CACHED:
+
+                @cache(**dict({'expire': 60, 'stale': 600, 'prefix': 'count'}, **(cached or {})))
+                async def cached_count(db: str, coll: str, param: List) -> int:
+                    return await self.count_query(param)
+
+                return await cached_count(self.db, self.coll, param)
         param.append({'$group': {"_id": None, "count": {"$sum": 1}}})
         return (await self.query(param, cached=cached) or [{'count': 0}]).pop(0).get('count', 0)
 
-    async def query(self, pipeline: List = [], sort={}, page: int = 1, page_size: int = 0, cached: dict = None) -> List:
+    async def optimize(self, pipeline: List) -> List:
+        '''
+        优化pipeline, 首个 $match 无法使用索引时按查询字段记录一次警告
+        '''
+        pipeline = optimize_pipeline(pipeline)
+        if pipeline and '$match' in pipeline[0]:
+            match = pipeline[0]['$match']
+            shape = tuple(sorted(match_fields(match) or ['$expr']))
+            if shape not in self._checked and len(self._checked) < 1000:
+                self._checked.add(shape)
+                indexed = await self.indexed_fields()
+                reason = indexed is not None and unindexed_match(match, indexed)
+                if reason:
+                    logger.warning(f"Pipeline on {self.tag} cannot use an index: {reason}")
+        return pipeline
+
+    async def indexed_fields(self) -> Optional[set]:
+        if self._indexed is None:
+            try:
+                info = await (await self.collection).index_information()
+                self._indexed = {x['key'][0][0] for x in info.values()}
+            except Exception:
+                logger.warning(f"Error loading indexes of {self.tag}", exc_info=True)
+                return None
+        return self._indexed
+
+    async def query(
+        self,
+        pipeline: List = [],
+        sort={},
+        page: int = 1,
+        page_size: int = 0,
+        cached: dict = None,
+        optimize: bool = True,
+        keep: List[str] = (),
+    ) -> List:
         if sort:
             pipeline.append({'$sort': sort})
         if page > 1:
             pipeline.append({'$skip': page_size * (page - 1)})
         if page_size > 0:
             pipeline.append({'$limit': page_size})
-        pipeline.append({'$project': {'_id': False}})
+        pipeline.append({'$project': self._project(pipeline, keep)})
+        if optimize:
+            pipeline = await self.optimize(pipeline)
         if cached:
 
-            @cache(**cached)
+            @cache(**self.cached(cached))
             async def use_cache(pipeline: List) -> List:
-                return await (await self.collection).aggregate(pipeline).to_list(length=None)
+                return await self.aggregate(pipeline)
 
             return await use_cache(pipeline)
-        return await (await self.collection).aggregate(pipeline).to_list(length=None)
+        return await self.aggregate(pipeline)
+
+    async def aggregate(self, pipeline: List) -> List:
+        start = time.perf_counter()
+        result = await (await self.collection).aggregate(pipeline).to_list(length=None)
+        self.observe(AGGREGATE, {'pipeline': pipeline}, start)
+        return result
+
+    def observe(self, kind: str, spec: dict, start: float) -> None:
+        advisor = index_advisor()
+        if advisor.enabled:
+            # 采样统计不能影响查询结果
+            try:
+                advisor.observe(self, kind, spec, time.perf_counter() - start)
+            except Exception:
+                logger.debug(f"Index advisor failed to observe {kind} on {self.tag}", exc_info=True)
+
+    def index_advice(self) -> dict:
+        '''
+        当前集合的查询形状统计和索引建议, 需要配置 index_advisor.sample_rate 或 slow_ms 开启采样
+        '''
+        return index_advisor().report(self.tag).get(self.tag, {'shapes': [], 'suggestions': []})
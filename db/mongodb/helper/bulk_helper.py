@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Any, AsyncIterable, Callable, Iterable, List, Union
+from loguru import logger
+from pymongo.errors import BulkWriteError
+
+
+async def chunked(items: Union[Iterable, AsyncIterable], size: int) -> AsyncIterable[list]:
+    '''
+    按size切分列表/迭代器/异步迭代器, 不会一次性读取全部数据
+    '''
+    chunk = []
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    else:
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class BulkWriter:
+    '''
+    分块批量写入: 每块一个 bulk_write, 最多 concurrency 个块同时提交;
+    ordered=False 时单条失败不影响同块其他操作, 同一个key的多次写入不保证顺序
+    '''
+
+    def __init__(
+        self,
+        collection: Any,
+        chunk_size: int = 1000,
+        concurrency: int = 4,
+        ordered: bool = False,
+        session: Any = None,
+    ) -> None:
+        assert chunk_size > 0 and concurrency > 0, "chunk_size and concurrency must be positive"
+        self.collection = collection
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.session = session
+
+    async def write(self, items: Union[Iterable, AsyncIterable], to_op: Callable[[Any], Any] = None) -> dict:
+        '''
+        items: 写操作或原始数据, 原始数据由 to_op 在提交前逐块转换
+        每块的 write_errors/write_concern_errors 保持pymongo的格式, write_errors 的 index 为该操作在整个输入中的序号;
+        非 BulkWriteError 的异常(网络等)整块计为失败, 异常保存在该块的 exception 中
+        返回 {'inserted', 'matched', 'modified', 'upserted', 'deleted', 'errors', 'chunks': [...]}, errors 为失败的操作数
+        '''
+        # 同一个session不能并发使用, 事务内退化为逐块提交
+        semaphore = asyncio.Semaphore(1 if self.session is not None else self.concurrency)
+        tasks: List[asyncio.Task] = []
+        index = 0
+        try:
+            async for chunk in chunked(items, self.chunk_size):
+                ops = [to_op(x) for x in chunk] if to_op else chunk
+                # 派发前获取信号量, 同时在途的块不超过 concurrency 个, 输入端随之背压
+                await semaphore.acquire()
+                task = asyncio.ensure_future(self._write_chunk(index, ops))
+                task.add_done_callback(lambda _: semaphore.release())
+                tasks.append(task)
+                index += 1
+        except BaseException:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        chunks = await asyncio.gather(*tasks)
+        report = {'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'deleted': 0, 'errors': 0}
+        for item in chunks:
+            for key in ('inserted', 'matched', 'modified', 'upserted', 'deleted'):
+                report[key] += item[key]
+            report['errors'] += item['failed']
+        report['chunks'] = chunks
+        return report
+
+    async def _write_chunk(self, index: int, ops: list) -> dict:
+        start = time.perf_counter()
+        result = {'chunk': index, 'size': len(ops), 'failed': 0, 'write_errors': [], 'write_concern_errors': [], 'exception': None}
+        try:
+            details = (await self.collection.bulk_write(ops, ordered=self.ordered, session=self.session)).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            offset = index * self.chunk_size
+            errors = details.get('writeErrors', [])
+            result['write_errors'] = [dict(x, index=offset + x.get('index', 0)) for x in errors]
+            result['write_concern_errors'] = details.get('writeConcernErrors', [])
+            # ordered 时第一个错误之后的操作都没有执行
+            result['failed'] = len(ops) - errors[0].get('index', 0) if self.ordered and errors else len(errors)
+        except Exception as e:
+            logger.error(f"Bulk write chunk={index} failed", exc_info=True)
+            details = {}
+            result['failed'] = len(ops)
+            result['exception'] = e
+        result.update(
+            inserted=details.get('nInserted', 0),
+            matched=details.get('nMatched', 0),
+            modified=details.get('nModified', 0),
+            upserted=details.get('nUpserted', 0),
+            deleted=details.get('nRemoved', 0),
+            elapsed=round(time.perf_counter() - start, 4),
+        )
+        return result
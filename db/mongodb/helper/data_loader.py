@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from contextvars import ContextVar, Token
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from base.util.wraps import spawn
+
+
+# 独立的ContextVar, 每个请求设置新的dict, 避免不同请求共享同一个memo
+_memo: ContextVar[Optional[Dict[str, dict]]] = ContextVar('loader_memo', default=None)
+
+
+def start_memo() -> Token:
+    '''
+    开启当前上下文(请求)内的查询结果缓存, 返回的token用于 reset_memo
+    '''
+    return _memo.set({})
+
+
+def reset_memo(token: Token) -> None:
+    _memo.reset(token)
+
+
+class DataLoader:
+    '''
+    同一个事件循环tick内的 load(id) 合并为一次 find({key: {'$in': ids}}), id去重后按id分发结果;
+    开启memo时同一个请求内重复的id直接使用内存中的结果
+    '''
+
+    def __init__(self, dao: Any, key: str = 'id', max_batch: int = 1000) -> None:
+        self.dao = dao
+        self.key = key
+        self.max_batch = max_batch
+        self._queue: Dict[Any, asyncio.Future] = {}
+        self._scheduled = False
+        self.loads = 0
+        self.batches = 0
+        self.deduped = 0
+        self.memo_hits = 0
+
+    def stats(self) -> dict:
+        return {
+            'loads': self.loads,
+            'batches': self.batches,
+            'deduped': self.deduped,
+            'memo_hits': self.memo_hits,
+            'avg_batch': round((self.loads - self.deduped - self.memo_hits) / self.batches, 2) if self.batches else 0,
+        }
+
+    async def load(self, id: Any) -> dict:
+        self.loads += 1
+        memo = _memo.get()
+        if memo is not None:
+            future = memo.setdefault(self.dao.tag, {}).get(id)
+            if future is not None:
+                self.memo_hits += 1
+                return dict(await asyncio.shield(future))
+        future = self._queue.get(id)
+        if future is None:
+            future = self._queue[id] = asyncio.get_running_loop().create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                asyncio.get_running_loop().call_soon(self._dispatch)
+        else:
+            self.deduped += 1
+        if memo is None:
+            return dict(await asyncio.shield(future))
+        memo[self.dao.tag][id] = future
+        try:
+            # 每个调用方拿到独立的dict, 互不影响
+            return dict(await asyncio.shield(future))
+        except Exception:
+            if memo.get(self.dao.tag, {}).get(id) is future:
+                del memo[self.dao.tag][id]
+            raise
+
+    async def load_many(self, ids: List[Any]) -> List[dict]:
+        return list(await asyncio.gather(*[self.load(x) for x in ids]))
+
+    def clear(self) -> None:
+        '''
+        清除当前请求内该集合的memo, 写入后调用
+        '''
+        memo = _memo.get()
+        if memo is not None:
+            memo.pop(self.dao.tag, None)
+
+    def _dispatch(self) -> None:
+        queue, self._queue, self._scheduled = self._queue, {}, False
+        items = list(queue.items())
+        for i in range(0, len(items), self.max_batch):
+            spawn(self._fetch(dict(items[i : i + self.max_batch])), f"load {self.dao.tag}")
+
+    async def _fetch(self, batch: Dict[Any, asyncio.Future]) -> None:
+        self.batches += 1
+        try:
+            cursor = (await self.dao.collection).find({self.key: {'$in': list(batch)}}, projection=dict(self.dao.projection, _id=False))
+            result = {x.get(self.key): x async for x in cursor}
+        except Exception as e:
+            logger.error(f"DataLoader {self.dao.tag} batch={len(batch)} failed", exc_info=True)
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for id, future in batch.items():
+            if not future.done():
+                future.set_result(result.get(id) or {})
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+from typing import Any, List, Optional, Tuple
+from loguru import logger
+from base.coroutine.key_builder import canonical_encode
+from base.di.service_location import config
+from base.util.wraps import spawn
+
+
+_RANGE = ('$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$regex', '$exists', '$not')
+FIND, COUNT, AGGREGATE = 'find', 'count', 'aggregate'
+
+
+def _field_kind(value: Any) -> str:
+    if isinstance(value, dict) and value and all(x.startswith('$') for x in value):
+        if any(x in value for x in _RANGE):
+            return 'range'
+        return 'in' if '$in' in value else 'eq'
+    return 'eq'
+
+
+def query_shape(filter: dict, sort: Any = None) -> dict:
+    '''
+    归一化的查询形状: 字段 -> eq/in/range, 不包含具体值
+    '''
+    shape = {'filter': {}, 'sort': {}}
+    for key, value in (filter or {}).items():
+        if key in ('$and',):
+            for item in value:
+                shape['filter'].update(query_shape(item)['filter'])
+        elif key.startswith('$'):
+            shape['filter'][key] = 'expr'
+        else:
+            shape['filter'][key] = _field_kind(value)
+    for key, value in (sort.items() if isinstance(sort, dict) else sort or []):
+        shape['sort'][key] = _sort_kind(value)
+    return shape
+
+
+def _sort_kind(value: Any) -> Any:
+    # {'$meta': 'textScore'} 等非数值排序作为单独的形状, 不参与索引建议
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 1 if value > 0 else -1
+    if isinstance(value, dict) and '$meta' in value:
+        return f"$meta:{value['$meta']}"
+    return str(value)
+
+
+def pipeline_filter(pipeline: List[dict]) -> Tuple[dict, dict]:
+    '''
+    pipeline开头可以下推到查询层的 $match 和 $sort
+    '''
+    filter, sort = {}, {}
+    for stage in pipeline:
+        if '$match' in stage and not sort:
+            filter = dict(filter, **stage['$match'])
+        elif '$sort' in stage and not sort:
+            sort = stage['$sort']
+        else:
+            break
+    return filter, sort
+
+
+def suggest_index(shape: dict) -> List[Tuple[str, int]]:
+    '''
+    按 ESR(等值-排序-范围) 顺序给出复合索引字段
+    '''
+    filter = shape['filter']
+    if any(x == 'expr' for x in filter.values()):
+        return []
+    keys = [(x, 1) for x, kind in filter.items() if kind in ('eq', 'in')]
+    sort = {x: y for x, y in shape['sort'].items() if y in (1, -1)}
+    keys += [(x, y) for x, y in sort.items() if x not in filter or filter[x] == 'range']
+    keys += [(x, 1) for x, kind in filter.items() if kind == 'range' and x not in sort]
+    return keys
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = []
+    while plan:
+        stage = plan.get('stage', '')
+        stages.append(f"{stage}({plan['indexName']})" if plan.get('indexName') else stage)
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return stages
+
+
+def parse_explain(explain: dict) -> dict:
+    for stage in explain.get('stages') or []:
+        if '$cursor' in stage:
+            explain = stage['$cursor']
+            break
+    planner, stats = explain.get('queryPlanner', {}), explain.get('executionStats', {})
+    winning = planner.get('winningPlan', {})
+    winning = winning.get('queryPlan', winning)
+    return {
+        'plan': _plan_stages(winning),
+        'docs_examined': stats.get('totalDocsExamined', 0),
+        'keys_examined': stats.get('totalKeysExamined', 0),
+        'returned': stats.get('nReturned', 0),
+        'explain_ms': stats.get('executionTimeMillis', 0),
+    }
+
+
+class IndexAdvisor:
+    '''
+    按 sample_rate 比例或耗时超过 slow_ms 的查询, 在后台执行 explain(executionStats),
+    按集合和查询形状汇总执行计划、扫描文档数与返回数, report 给出复合索引建议
+    '''
+
+    def __init__(
+        self, sample_rate: float = 0, slow_ms: float = 0, interval: float = 300, max_shapes: int = 1000, concurrency: int = 2
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.max_shapes = max_shapes
+        self.concurrency = concurrency
+        self._shapes: dict = {}
+        self._running = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def observe(self, dao: Any, kind: str, spec: dict, elapsed: float) -> None:
+        '''
+        spec: find/count 为 {'filter', 'sort'}, aggregate 为 {'pipeline'}
+        '''
+        slow = self.slow_ms > 0 and elapsed * 1000 >= self.slow_ms
+        if not slow and random.random() >= self.sample_rate:
+            return
+        filter, sort = (spec.get('filter'), spec.get('sort')) if kind != AGGREGATE else pipeline_filter(spec['pipeline'])
+        shape = query_shape(filter, sort)
+        key = canonical_encode((dao.tag, kind, shape))
+        entry = self._shapes.get(key)
+        if entry is None:
+            if len(self._shapes) >= self.max_shapes:
+                return
+            entry = self._shapes[key] = {
+                'collection': dao.tag,
+                'kind': kind,
+                'shape': shape,
+                'count': 0,
+                'slow': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'explained_at': None,
+            }
+        entry['count'] += 1
+        entry['slow'] += int(slow)
+        entry['total_ms'] += elapsed * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+        explained_at = entry['explained_at']
+        if (explained_at is None or time.monotonic() - explained_at >= self.interval) and self._running < self.concurrency:
+            entry['explained_at'] = time.monotonic()
+            self._running += 1
+            spawn(self._explain(dao, kind, spec, entry), f"explain {dao.tag}")
+
+    async def _explain(self, dao: Any, kind: str, spec: dict, entry: dict) -> None:
+        try:
+            collection = await dao.collection
+            if kind == FIND:
+                command = {'find': dao.coll, 'filter': spec.get('filter') or {}}
+                if spec.get('sort'):
+                    command['sort'] = dict(spec['sort'])
+            elif kind == COUNT:
+                command = {'count': dao.coll, 'query': spec.get('filter') or {}}
+            else:
+                command = {'aggregate': dao.coll, 'pipeline': spec['pipeline'], 'cursor': {}}
+            explain = await collection.database.command({'explain': command, 'verbosity': 'executionStats'})
+            entry.update(parse_explain(explain))
+        except Exception:
+            logger.warning(f"Explain failed on {dao.tag}", exc_info=True)
+        finally:
+            self._running -= 1
+
+    def report(self, collection: Optional[str] = None) -> dict:
+        '''
+        返回 {collection: {'shapes': [...], 'suggestions': [...]}}, 只对全表扫描或扫描/返回比超过10的查询给出索引建议
+        '''
+        result = {}
+        for entry in self._shapes.values():
+            if collection and entry['collection'] != collection:
+                continue
+            item = result.setdefault(entry['collection'], {'shapes': [], 'suggestions': {}})
+            shape = dict(entry, avg_ms=round(entry['total_ms'] / entry['count'], 3) if entry['count'] else 0)
+            shape.pop('explained_at')
+            shape['total_ms'] = round(shape['total_ms'], 3)
+            shape['max_ms'] = round(shape['max_ms'], 3)
+            item['shapes'].append(shape)
+            if 'plan' not in entry:
+                continue
+            scanned = entry['docs_examined'] / max(entry['returned'], 1)
+            if not any(x.startswith('COLLSCAN') for x in entry['plan']) and scanned <= 10:
+                continue
+            keys = suggest_index(entry['shape'])
+            if not keys:
+                continue
+            suggestion = item['suggestions'].setdefault(
+                tuple(keys), {'keys': keys, 'queries': 0, 'total_ms': 0.0, 'shapes': 0, 'max_scan_ratio': 0}
+            )
+            suggestion['queries'] += entry['count']
+            suggestion['total_ms'] = round(suggestion['total_ms'] + entry['total_ms'], 3)
+            suggestion['shapes'] += 1
+            suggestion['max_scan_ratio'] = max(suggestion['max_scan_ratio'], round(scanned, 2))
+        for item in result.values():
+            item['shapes'].sort(key=lambda x: x['total_ms'], reverse=True)
+            item['suggestions'] = self._merge(list(item['suggestions'].values()))
+        return result
+
+    def _merge(self, suggestions: List[dict]) -> List[dict]:
+        # 某个建议是另一个建议的前缀时, 长的索引可以同时覆盖两者
+        suggestions.sort(key=lambda x: len(x['keys']), reverse=True)
+        merged = []
+        for item in suggestions:
+            target = next((x for x in merged if x['keys'][: len(item['keys'])] == item['keys']), None)
+            if target is None:
+                merged.append(item)
+                continue
+            target['queries'] += item['queries']
+            target['total_ms'] = round(target['total_ms'] + item['total_ms'], 3)
+            target['shapes'] += item['shapes']
+            target['max_scan_ratio'] = max(target['max_scan_ratio'], item['max_scan_ratio'])
+        return sorted(merged, key=lambda x: x['total_ms'], reverse=True)
+
+    def clear(self) -> None:
+        self._shapes.clear()
+
+
+_advisor: Optional[IndexAdvisor] = None
+
+
+def index_advisor() -> IndexAdvisor:
+    '''
+    全局实例, 配置项 index_advisor: {sample_rate, slow_ms, interval, max_shapes, concurrency}, 默认关闭
+    '''
+    global _advisor
+    if _advisor is None:
+        _advisor = IndexAdvisor(**(config('index_advisor') or {}))
+    return _advisor
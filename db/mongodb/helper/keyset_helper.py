@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import base64
+from typing import Any, List
+from bson import json_util
+
+
+def keyset_sort(sort: dict, key: str = 'id') -> dict:
+    '''
+    游标分页的排序必须唯一, 末尾补充主键; 不支持 {'$meta': ...} 排序
+    '''
+    if any(isinstance(v, dict) for v in (sort or {}).values()):
+        raise ValueError('cursor pagination does not support $meta sort')
+    sort = {k: 1 if int(v) > 0 else -1 for k, v in (sort or {}).items()}
+    if key not in sort:
+        sort[key] = list(sort.values())[-1] if sort else 1
+    return sort
+
+
+def _field(record: dict, key: str) -> Any:
+    # 支持 a.b 形式的嵌套字段
+    for part in key.split('.'):
+        record = record.get(part) if isinstance(record, dict) else None
+    return record
+
+
+def encode_cursor(sort: dict, record: dict) -> str:
+    data = json_util.dumps([list(sort.keys()), [_field(record, k) for k in sort]], json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode().rstrip('=')
+
+
+def decode_cursor(sort: dict, cursor: str) -> List[Any]:
+    try:
+        keys, values = json_util.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if keys != list(sort.keys()):
+        raise ValueError('cursor does not match sort')
+    return values
+
+
+def _after(key: str, direction: int, value: Any) -> Any:
+    '''
+    排序在 value 之后的条件; Mongo中 null/缺失 排在最小, 而 $gt/$lt 不会匹配 null
+    '''
+    if value is None:
+        # 升序时 null 之后是所有非空值, 降序时 null 排在最后
+        return {key: {'$ne': None}} if direction > 0 else None
+    if direction > 0:
+        return {key: {'$gt': value}}
+    return {'$or': [{key: {'$lt': value}}, {key: None}]}
+
+
+def keyset_match(sort: dict, values: List[Any]) -> dict:
+    items = list(sort.items())
+    conditions = []
+    for i, (key, direction) in enumerate(items):
+        after = _after(key, direction, values[i])
+        if after is None:
+            continue
+        # 前面的字段相等, 等于 null 同时匹配字段缺失
+        condition = {k: values[j] for j, (k, _) in enumerate(items[:i])}
+        condition.update(after)
+        conditions.append(condition)
+    if not conditions:
+        # 不依赖 _id, 前面的阶段可能已经去掉了 _id
+        return {'$expr': False}
+    return {'$or': conditions} if len(conditions) > 1 else conditions[0]
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from typing import Callable
+from base.coroutine.key_builder import register_encoder
+from .pipeline_optimizer import optimize_pipeline
 
 
 class Pipeline:
@@ -66,6 +68,13 @@ class Pipeline:
             self._data.append({'$addFields': fields})
         return self
 
+    def optimize(self):
+        self._data = optimize_pipeline(self._data)
+        return self
+
+
+register_encoder(Pipeline, lambda x: x.data)
+
 
 class MatchHelper:
     match_map = {
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from typing import Iterable, List, Optional, Set
+
+
+# $match/$sort/$skip/$limit 可以移动到这些阶段之前, 前提是不引用它们产生的字段
+_LOOKUP, _UNWIND = '$lookup', '$unwind'
+# 无法利用索引的字段条件
+_UNINDEXABLE = ('$not', '$nin', '$ne', '$where', '$expr')
+
+
+def _stage(stage: dict) -> str:
+    return next(iter(stage)) if len(stage) == 1 else ''
+
+
+def match_fields(match: dict) -> Optional[Set[str]]:
+    '''
+    $match 引用的字段, 包含 $expr/$where 等无法静态分析的条件时返回None
+    '''
+    fields = set()
+    for key, value in match.items():
+        if key in ('$and', '$or', '$nor'):
+            for item in value:
+                sub = match_fields(item)
+                if sub is None:
+                    return None
+                fields |= sub
+        elif key.startswith('$'):
+            return None
+        else:
+            fields.add(key)
+    return fields
+
+
+def produced_fields(stage: dict) -> Set[str]:
+    name, value = _stage(stage), next(iter(stage.values()))
+    if name == _LOOKUP:
+        return {value['as']}
+    path = value if isinstance(value, str) else value.get('path', '')
+    fields = {path.lstrip('$')}
+    if isinstance(value, dict) and value.get('includeArrayIndex'):
+        fields.add(value['includeArrayIndex'])
+    return fields
+
+
+def _touches(fields: Iterable[str], produced: Set[str]) -> bool:
+    for field in fields:
+        for item in produced:
+            if field == item or field.startswith(item + '.') or item.startswith(field + '.'):
+                return True
+    return False
+
+
+def _can_pass(stage: dict, prev: dict) -> bool:
+    name, prev_name = _stage(stage), _stage(prev)
+    if prev_name not in (_LOOKUP, _UNWIND):
+        return False
+    if name == '$match':
+        fields = match_fields(stage['$match'])
+        return fields is not None and not _touches(fields, produced_fields(prev))
+    # $lookup 一进一出不改变文档数量和顺序, $unwind 会改变, 排序分页只能越过 $lookup
+    if name == '$sort':
+        return prev_name == _LOOKUP and not _touches(stage['$sort'].keys(), produced_fields(prev))
+    return name in ('$skip', '$limit') and prev_name == _LOOKUP
+
+
+def _split_match(stage: dict, prev: dict) -> Optional[tuple]:
+    '''
+    $match 中不引用 prev 产生字段的条件拆出来, 返回 (可前移部分, 剩余部分)
+    '''
+    if _stage(stage) != '$match' or _stage(prev) not in (_LOOKUP, _UNWIND):
+        return None
+    produced, movable, rest = produced_fields(prev), {}, {}
+    for key, value in stage['$match'].items():
+        fields = match_fields({key: value})
+        if fields is not None and not _touches(fields, produced):
+            movable[key] = value
+        else:
+            rest[key] = value
+    return (movable, rest) if movable and rest else None
+
+
+def _is_noop(stage: dict) -> bool:
+    name = _stage(stage)
+    value = stage.get(name)
+    return (name in ('$match', '$sort', '$addFields', '$set', '$unset') and not value) or (name == '$skip' and value == 0)
+
+
+def _merge_match(a: dict, b: dict) -> dict:
+    if not set(a) & set(b):
+        return dict(a, **b)
+    return {'$and': [a, b]}
+
+
+def _merge(stages: List[dict]) -> List[dict]:
+    result = []
+    for stage in stages:
+        if _is_noop(stage):
+            continue
+        prev = result[-1] if result else None
+        name = _stage(stage)
+        if prev is not None and name and _stage(prev) == name:
+            if name == '$match':
+                result[-1] = {'$match': _merge_match(prev['$match'], stage['$match'])}
+                continue
+            if name == '$limit':
+                result[-1] = {'$limit': min(prev['$limit'], stage['$limit'])}
+                continue
+            if name == '$skip':
+                result[-1] = {'$skip': prev['$skip'] + stage['$skip']}
+                continue
+        result.append(stage)
+    return result
+
+
+def optimize_pipeline(pipeline: List[dict]) -> List[dict]:
+    '''
+    提交前的pipeline优化, 返回新列表, 不修改传入的pipeline:
+    去掉空阶段; 合并相邻的 $match/$skip/$limit;
+    不引用 $lookup/$unwind 产生字段的 $match 前移, $sort/$skip/$limit 前移越过 $lookup
+    '''
+    stages = _merge(pipeline)
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(stages)):
+            if _can_pass(stages[i], stages[i - 1]):
+                stages[i - 1], stages[i] = stages[i], stages[i - 1]
+                moved = True
+            elif split := _split_match(stages[i], stages[i - 1]):
+                stages[i - 1 : i + 1] = [{'$match': split[0]}, stages[i - 1], {'$match': split[1]}]
+                moved = True
+                break
+        if moved:
+            stages = _merge(stages)
+    return stages
+
+
+def unindexed_match(match: dict, indexed: Set[str]) -> Optional[str]:
+    '''
+    首个 $match 无法使用索引的原因, 可以使用时返回None
+    indexed: 集合各索引的第一个字段
+    '''
+    fields = match_fields(match)
+    if fields is None:
+        return 'uses $expr/$where'
+    if '$or' in match or '$nor' in match:
+        return None if fields <= indexed else 'has $or branches on unindexed fields'
+    usable = set()
+    for key, value in match.items():
+        if key.startswith('$'):
+            usable |= match_fields({key: value}) or set()
+            continue
+        if isinstance(value, dict) and any(x in value for x in _UNINDEXABLE):
+            continue
+        if isinstance(value, dict) and isinstance(value.get('$regex'), str) and not value['$regex'].startswith('^'):
+            continue
+        usable.add(key)
+    if usable & indexed:
+        return None
+    return f'no index on {sorted(fields)}' if fields else 'has no filter'
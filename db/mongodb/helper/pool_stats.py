@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import deque
+from typing import Any
+from pymongo.monitoring import ConnectionPoolListener
+
+
+class PoolStats(ConnectionPoolListener):
+    '''
+    连接池监听器, 按服务器地址统计: 当前/峰值借出连接数, 借出等待时间, 连接创建速率;
+    pymongo在后台线程中回调, 统计数据加锁
+    '''
+
+    def __init__(self, window: float = 60) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools: dict = {}
+
+    def _pool(self, address: Any) -> dict:
+        key = f'{address[0]}:{address[1]}' if isinstance(address, tuple) else str(address)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {
+                'created': 0,
+                'closed': 0,
+                'checked_out': 0,
+                'max_checked_out': 0,
+                'checkouts': 0,
+                'checkout_failed': 0,
+                'wait_total': 0.0,
+                'wait_max': 0.0,
+                'cleared': 0,
+                'created_at': deque(),
+            }
+        return pool
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for address, pool in self._pools.items():
+                created_at = self._prune(pool, now)
+                result[address] = {
+                    'open': pool['created'] - pool['closed'],
+                    'created': pool['created'],
+                    'closed': pool['closed'],
+                    'checked_out': pool['checked_out'],
+                    'max_checked_out': pool['max_checked_out'],
+                    'checkouts': pool['checkouts'],
+                    'checkout_failed': pool['checkout_failed'],
+                    'wait_avg_ms': round(pool['wait_total'] * 1000 / pool['checkouts'], 3) if pool['checkouts'] else 0,
+                    'wait_max_ms': round(pool['wait_max'] * 1000, 3),
+                    'created_per_min': round(len(created_at) * 60 / self.window, 2),
+                    'cleared': pool['cleared'],
+                }
+        return result
+
+    def _prune(self, pool: dict, now: float) -> deque:
+        # 只保留窗口内的创建时间, 不调用 snapshot 时也不会无限增长
+        created_at = pool['created_at']
+        while created_at and now - created_at[0] > self.window:
+            created_at.popleft()
+        return created_at
+
+    def _wait(self, event: Any) -> float:
+        # pymongo 4.7+ 事件自带duration, 旧版本用同线程记录的开始时间
+        duration = getattr(event, 'duration', None)
+        if duration is None:
+            start = getattr(self._local, 'start', None)
+            duration = time.monotonic() - start if start is not None else 0
+        return duration
+
+    def pool_created(self, event: Any) -> None:
+        pass
+
+    def pool_ready(self, event: Any) -> None:
+        pass
+
+    def pool_cleared(self, event: Any) -> None:
+        with self._lock:
+            self._pool(event.address)['cleared'] += 1
+
+    def pool_closed(self, event: Any) -> None:
+        pass
+
+    def connection_created(self, event: Any) -> None:
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['created'] += 1
+            now = time.monotonic()
+            self._prune(pool, now).append(now)
+
+    def connection_ready(self, event: Any) -> None:
+        pass
+
+    def connection_closed(self, event: Any) -> None:
+        with self._lock:
+            self._pool(event.address)['closed'] += 1
+
+    def connection_check_out_started(self, event: Any) -> None:
+        self._local.start = time.monotonic()
+
+    def connection_check_out_failed(self, event: Any) -> None:
+        with self._lock:
+            self._pool(event.address)['checkout_failed'] += 1
+
+    def connection_checked_out(self, event: Any) -> None:
+        wait = self._wait(event)
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['checkouts'] += 1
+            pool['checked_out'] += 1
+            pool['max_checked_out'] = max(pool['max_checked_out'], pool['checked_out'])
+            pool['wait_total'] += wait
+            pool['wait_max'] = max(pool['wait_max'], wait)
+
+    def connection_checked_in(self, event: Any) -> None:
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['checked_out'] = max(pool['checked_out'] - 1, 0)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Any, List
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from base.coroutine.key_builder import canonical_encode
+from base.util.wraps import spawn
+
+
+_buffers: List['WriteBuffer'] = []
+
+
+async def close_buffers() -> None:
+    '''
+    刷新并关闭全部写缓冲, 在应用关闭时调用
+    '''
+    for buffer in list(_buffers):
+        try:
+            await buffer.close()
+        except Exception:
+            logger.error(f"Error flushing write buffer {buffer.name}", exc_info=True)
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    # 无人等待的失败写入只记日志, 避免 "exception was never retrieved"
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Buffered write failed: {future.exception()}")
+
+
+class WriteBuffer:
+    '''
+    写缓冲: 同一个matcher的 $set 在内存中合并, 数量达到 max_ops 或每隔 interval 秒合并为一次 bulk_write;
+    待写入数量达到 max_pending 时写入方等待刷新完成(背压);
+    save 返回的 Future 在数据落库后完成, 需要确认写入的调用方 await 即可
+    '''
+
+    def __init__(self, dao: Any, max_ops: int = 1000, max_pending: int = 10000, interval: float = 1) -> None:
+        self.dao = dao
+        self.name = dao.tag
+        self.max_ops = max_ops
+        self.max_pending = max(max_pending, max_ops)
+        self.interval = interval
+        self._pending: dict = {}
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self.writes = 0
+        self.merged = 0
+        self.flushes = 0
+        self.failed = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+        self.waited = 0
+        _buffers.append(self)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'writes': self.writes,
+            'merged': self.merged,
+            'flushes': self.flushes,
+            'failed': self.failed,
+            'backpressure_waits': self.waited,
+            'avg_flush_ms': round(self.flush_time * 1000 / self.flushes, 3) if self.flushes else 0,
+            'max_flush_ms': round(self.max_flush_time * 1000, 3),
+        }
+
+    async def save(
+        self, matcher: dict, data: dict, set_on_insert: dict = None, upsert: bool = True, wait: bool = False
+    ) -> asyncio.Future:
+        if self._closed:
+            raise RuntimeError(f'Write buffer {self.name} is closed')
+        if len(self._pending) >= self.max_pending:
+            self.waited += 1
+            await self.flush()
+        self.writes += 1
+        key = canonical_encode((matcher, upsert))
+        entry = self._pending.get(key)
+        if entry is None:
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(_retrieve)
+            entry = self._pending[key] = [matcher, {}, {}, upsert, future]
+        else:
+            self.merged += 1
+        entry[1].update(data)
+        # 先写入的 $setOnInsert 保留(id/createTime等), 与 $set 冲突的字段以 $set 为准
+        for k, v in (set_on_insert or {}).items():
+            entry[2].setdefault(k, v)
+        self._ensure_timer()
+        if len(self._pending) >= self.max_ops:
+            spawn(self.flush(), f"flush {self.dao.tag}")
+        if wait:
+            await asyncio.shield(entry[4])
+        return entry[4]
+
+    async def flush(self) -> int:
+        # 取出待写数据后被取消(close/调用方取消)会丢失这批写入, 刷新本身不随调用方取消
+        return await asyncio.shield(self._flush())
+
+    async def _flush(self) -> int:
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = list(self._pending.values()), {}
+            ops = []
+            for matcher, data, insert, upsert, _ in pending:
+                update = {'$set': data}
+                insert = {k: v for k, v in insert.items() if k not in data}
+                if insert:
+                    update['$setOnInsert'] = insert
+                ops.append(UpdateOne(matcher, update, upsert=upsert))
+            start = time.perf_counter()
+            errors = {}
+            try:
+                await (await self.dao.collection).bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                errors = {x.get('index'): e for x in e.details.get('writeErrors', [])}
+                if not errors:
+                    errors = {i: e for i in range(len(pending))}
+            except Exception as e:
+                errors = {i: e for i in range(len(pending))}
+            elapsed = time.perf_counter() - start
+            self.flushes += 1
+            self.failed += len(errors)
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+            if errors:
+                logger.error(f"Write buffer {self.name} flush failed ops={len(errors)}/{len(ops)}")
+            for i, (*_, future) in enumerate(pending):
+                if future.done():
+                    continue
+                if i in errors:
+                    future.set_exception(errors[i])
+                else:
+                    future.set_result(True)
+        await self.dao.invalidate()
+        return len(ops)
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self in _buffers:
+            _buffers.remove(self)
+
+    def _ensure_timer(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.error(f"Write buffer {self.name} flush failed", exc_info=True)
+            if not self._pending:
+                self._task = None
+                return
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+from loguru import logger
+from redis.asyncio.client import AbstractRedis
+from redis.asyncio.cluster import AbstractRedisCluster
+from db.cache_helper import CacheInterface
+from db.memory.lru_cache import LRUCache
+from db.redis.redis_manager import RedisCache
+
+
+class NearCache(CacheInterface):
+    '''
+    两级缓存: 进程内L1(LRUCache) + Redis L2, 通过Redis pub/sub在所有worker间失效L1;
+    redis-py 的异步集群客户端不支持 pubsub, 只能使用单机/哨兵客户端
+    '''
+
+    def __init__(
+        self,
+        redis: AbstractRedis,
+        prefix: str = 'cache',
+        max_size: int = 1000,
+        max_bytes: int = 0,
+        expire: float = 5,
+        channel: str = None,
+    ) -> None:
+        if isinstance(redis, AbstractRedisCluster):
+            raise TypeError('NearCache requires a non-cluster redis client, async RedisCluster has no pubsub')
+        self.remote = RedisCache(redis, prefix)
+        self.local = LRUCache(max_size, max_bytes)
+        # L1最长保留时间, 订阅断开期间脏数据的上限
+        self.expire = expire
+        self.channel = channel or f'{prefix}:invalidate'
+        self.node = uuid4().hex
+        self._listener: asyncio.Task = None
+        self._generation = 0
+        self._metrics = {'l1': [0, 0.0], 'l2': [0, 0.0]}
+        self.remote_hits = 0
+        self.remote_misses = 0
+
+    def stats(self) -> dict:
+        l1 = self.local.stats()
+        remote_total = self.remote_hits + self.remote_misses
+        return {
+            'l1': dict(l1, avg_ms=self._avg('l1')),
+            'l2': {
+                'hits': self.remote_hits,
+                'misses': self.remote_misses,
+                'hit_ratio': round(self.remote_hits / remote_total, 4) if remote_total else 0,
+                'avg_ms': self._avg('l2'),
+            },
+            'subscribed': self._listener is not None and not self._listener.done(),
+        }
+
+    def _avg(self, tier: str) -> float:
+        count, total = self._metrics[tier]
+        return round(total * 1000 / count, 3) if count else 0
+
+    def _timing(self, tier: str, start: float) -> None:
+        metric = self._metrics[tier]
+        metric[0] += 1
+        metric[1] += time.perf_counter() - start
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        self._listen()
+        start = time.perf_counter()
+        _, item = await self.local.get_with_ttl(key)
+        self._timing('l1', start)
+        if item is not None:
+            deadline, value = item
+            return (max(round(deadline - time.monotonic()), 0) if deadline else -1), value
+        generation = self._generation
+        start = time.perf_counter()
+        ttl, value = await self.remote.get_with_ttl(key)
+        self._timing('l2', start)
+        if value is None:
+            self.remote_misses += 1
+        else:
+            self.remote_hits += 1
+            if generation == self._generation:
+                await self._fill(key, value, ttl if ttl > 0 else None)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        _, value = await self.get_with_ttl(key)
+        return value
+
+    async def set(self, key: str, value: Any, expire: Optional[float] = None) -> None:
+        self._listen()
+        await self.remote.set(key, value, expire)
+        await self._publish(key)
+        await self._fill(key, value, expire)
+
+    async def delete(self, key: str) -> Optional[int]:
+        self._listen()
+        await self.local.delete(key)
+        result = await self.remote.delete(key)
+        await self._publish(key)
+        return result
+
+    async def get_many(self, keys: List[str]) -> List[Tuple[int, Optional[bytes]]]:
+        self._listen()
+        result = [await self.local.get_with_ttl(key) for key in keys]
+        for i, (_, item) in enumerate(result):
+            if item is not None:
+                deadline, value = item
+                result[i] = (max(round(deadline - time.monotonic()), 0) if deadline else -1), value
+        missing = [i for i, (_, item) in enumerate(result) if item is None]
+        if not missing:
+            return result
+        generation = self._generation
+        start = time.perf_counter()
+        remote = await self.remote.get_many([keys[i] for i in missing])
+        self._timing('l2', start)
+        for i, (ttl, value) in zip(missing, remote):
+            result[i] = (ttl, value)
+            if value is None:
+                self.remote_misses += 1
+                continue
+            self.remote_hits += 1
+            if generation == self._generation:
+                await self._fill(keys[i], value, ttl if ttl > 0 else None)
+        return result
+
+    async def set_many(self, items: Dict[str, Any], expire: Optional[float] = None) -> None:
+        self._listen()
+        await self.remote.set_many(items, expire)
+        await self._publish(*items.keys())
+        for key, value in items.items():
+            await self._fill(key, value, expire)
+
+    async def delete_many(self, keys: List[str]) -> int:
+        self._listen()
+        for key in keys:
+            await self.local.delete(key)
+        result = await self.remote.delete_many(keys)
+        await self._publish(*keys)
+        return result
+
+    async def delete_pattern(self, pattern: str) -> int:
+        self._listen()
+        await self.local.delete_pattern(pattern)
+        result = await self.remote.delete_pattern(pattern)
+        await self._publish(f'*{pattern}')
+        return result
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        await self.local.clear()
+
+    async def _fill(self, key: str, value: Any, expire: Optional[float] = None) -> None:
+        deadline = time.monotonic() + expire if expire and expire > 0 else 0
+        await self.local.set(key, (deadline, value), min(expire, self.expire) if expire and expire > 0 else self.expire)
+
+    async def _publish(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            await self.remote.redis.publish(self.channel, f'{self.node}:' + '\n'.join(keys))
+        except Exception as e:
+            logger.warning(f'NearCache publish invalidation failed channel={self.channel} keys={len(keys)}: {e}')
+
+    def _listen(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._subscribe())
+
+    async def _subscribe(self) -> None:
+        while True:
+            pubsub = self.remote.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # 订阅前可能错过了失效消息
+                self._generation += 1
+                await self.local.clear()
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    data = message['data']
+                    node, _, keys = (data.decode() if isinstance(data, bytes) else data).partition(':')
+                    if node != self.node:
+                        self._generation += 1
+                        for key in keys.split('\n'):
+                            if key.startswith('*'):
+                                await self.local.delete_pattern(key[1:])
+                            else:
+                                await self.local.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'NearCache subscribe channel={self.channel} lost: {e}')
+                self._generation += 1
+                await self.local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.reset()
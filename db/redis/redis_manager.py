@@ -3,10 +3,12 @@ from contextlib import asynccontextmanager
 from functools import wraps
 from redis.asyncio.client import AbstractRedis
 from redis.asyncio.cluster import AbstractRedisCluster
-from typing import Any, Awaitable, Callable, Union, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Union, Optional, Tuple
 from loguru import logger
 from redis import asyncio as aioredis
+from redis.crc import key_slot
 from redis.asyncio.lock import Lock
+from redis.exceptions import LockError, LockNotOwnedError
 from base.di.service_location import BaseService, service
 from base.types import P, R
 from ..cache_helper import CacheInterface
@@ -41,6 +43,56 @@ class RedisCache(CacheInterface):
     async def delete(self, key: str) -> Optional[int]:
         return await self.redis.delete(f"{self.prefix}:{key}")
 
+    def _slots(self, keys: List[str]) -> List[List[str]]:
+        if not self.is_cluster:
+            return [keys]
+        groups = {}
+        for key in keys:
+            groups.setdefault(key_slot(key.encode('utf-8')), []).append(key)
+        return list(groups.values())
+
+    async def get_many(self, keys: List[str]) -> List[Tuple[int, Optional[bytes]]]:
+        if not keys:
+            return []
+        keys = [f"{self.prefix}:{key}" for key in keys]
+        groups = self._slots(keys)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for group in groups:
+                pipe.mget(group)
+            for key in keys:
+                pipe.ttl(key)
+            result = await pipe.execute()
+        values = {}
+        for group, items in zip(groups, result[: len(groups)]):
+            values.update(zip(group, items))
+        return [(ttl, values.get(key)) for key, ttl in zip(keys, result[len(groups) :])]
+
+    async def set_many(self, items: Dict[str, Any], expire: Optional[float] = None) -> None:
+        if not items:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(f"{self.prefix}:{key}", value, ex=expire or None)
+            await pipe.execute()
+
+    async def delete_many(self, keys: List[str]) -> int:
+        if not keys:
+            return 0
+        groups = self._slots([f"{self.prefix}:{key}" for key in keys])
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for group in groups:
+                pipe.unlink(*group)
+            return sum(await pipe.execute())
+
+    async def delete_pattern(self, pattern: str, count: int = 500) -> int:
+        total, keys = 0, []
+        async for key in self.redis.scan_iter(match=f"{self.prefix}:{pattern}", count=count):
+            keys.append((key.decode() if isinstance(key, bytes) else key)[len(self.prefix) + 1 :])
+            if len(keys) >= count:
+                total += await self.delete_many(keys)
+                keys = []
+        return total + await self.delete_many(keys)
+
 
 def redis_lock(key: Any, name: str = 'redis.default', timeout: float = 10) -> Callable[P, Awaitable[R]]:
     def wrapper(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
@@ -56,10 +108,17 @@ def redis_lock(key: Any, name: str = 'redis.default', timeout: float = 10) -> Ca
 
 
 @asynccontextmanager
-async def with_redis_lock(key: Any, name: str = 'redis.default', timeout: float = 10) -> Lock:
-    lock = Lock(service.get(name).client, key, timeout=timeout)
-    await lock.acquire()
+async def with_redis_lock(
+    key: Any, name: str = 'redis.default', timeout: float = 10, blocking_timeout: float = None
+) -> Lock:
+    lock = Lock(service.get(name).client, key, timeout=timeout, blocking_timeout=blocking_timeout)
+    if not await lock.acquire():
+        raise LockError(f'Unable to acquire lock {key}')
     try:
         yield lock
     finally:
-        await lock.release()
+        try:
+            await lock.release()
+        except LockNotOwnedError:
+            # 执行超过 timeout 锁已过期, 结果已经产生, 不影响调用方
+            logger.warning(f'Lock {key} expired before release, timeout={timeout}s')
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 服务配置在导入时加载, 必须在导入项目模块之前设置
+os.environ.setdefault('CONFIG_PATH', os.path.join(ROOT, 'tests', 'configs'))
+
+
+@pytest.fixture
+def mongo_dao():
+    '''
+    基于 mongomock 的 CommonDAHelper, 每个用例使用独立的集合
+    '''
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    from uuid import uuid4
+    from base.di.service_location import service
+    from db.mongodb.common_da_helper import CommonDAHelper
+
+    client = mongomock_motor.AsyncMongoMockClient()
+
+    class MockClient:
+        async def get_client(self):
+            return client
+
+    service.sl_map['db.test'] = MockClient()
+
+    def build(model=None) -> CommonDAHelper:
+        return CommonDAHelper('test', f'c_{uuid4().hex[:8]}', name='db.test', model=model)
+
+    yield build
+    service.sl_map.pop('db.test', None)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+from db.mongodb.helper.bulk_helper import BulkWriter
+
+
+class FakeCollection:
+    '''
+    按块序号返回结果: failures[块序号] 为 BulkWriteError 的 writeErrors(块内序号) 或异常
+    '''
+
+    def __init__(self, failures: dict = None) -> None:
+        self.failures = failures or {}
+        self.calls = 0
+
+    async def bulk_write(self, ops, ordered=False, session=None):
+        index = self.calls
+        self.calls += 1
+        await asyncio.sleep(0)
+        failure = self.failures.get(index)
+        if isinstance(failure, Exception):
+            raise failure
+        errors = failure or []
+        executed = errors[0]['index'] if ordered and errors else len(ops) - len(errors)
+        details = {
+            'nInserted': executed,
+            'nMatched': 0,
+            'nModified': 0,
+            'nUpserted': 0,
+            'nRemoved': 0,
+            'writeErrors': errors,
+            'writeConcernErrors': [],
+            'upserted': [],
+        }
+        if errors:
+            raise BulkWriteError(details)
+        return SimpleNamespace(bulk_api_result=details)
+
+
+def ops(count: int) -> list:
+    return [InsertOne({'id': i}) for i in range(count)]
+
+
+def write(collection: FakeCollection, items, **kwargs) -> dict:
+    return asyncio.run(BulkWriter(collection, **kwargs).write(items))
+
+
+def test_counts_all_chunks():
+    report = write(FakeCollection(), ops(25), chunk_size=10)
+    assert report['inserted'] == 25 and report['errors'] == 0
+    assert [x['size'] for x in report['chunks']] == [10, 10, 5]
+
+
+def test_write_errors_keep_global_index():
+    failures = {1: [{'index': 3, 'code': 11000, 'errmsg': 'dup'}]}
+    report = write(FakeCollection(failures), ops(25), chunk_size=10)
+    assert report['errors'] == 1
+    assert report['inserted'] == 24
+    assert report['chunks'][1]['write_errors'] == [{'index': 13, 'code': 11000, 'errmsg': 'dup'}]
+
+
+def test_ordered_chunk_counts_unexecuted_ops():
+    failures = {0: [{'index': 4, 'code': 11000, 'errmsg': 'dup'}]}
+    report = write(FakeCollection(failures), ops(10), chunk_size=10, ordered=True)
+    assert report['errors'] == 6
+    assert report['inserted'] == 4
+
+
+def test_exception_fails_whole_chunk():
+    error = AutoReconnect('network')
+    report = write(FakeCollection({0: error}), ops(15), chunk_size=10)
+    assert report['errors'] == 10
+    assert report['inserted'] == 5
+    assert report['chunks'][0]['exception'] is error
+
+
+def test_to_op_and_async_input():
+    async def items():
+        for i in range(7):
+            yield {'id': i}
+
+    writer = BulkWriter(FakeCollection(), chunk_size=3)
+    report = asyncio.run(writer.write(items(), to_op=InsertOne))
+    assert report['inserted'] == 7 and len(report['chunks']) == 3
+
+
+def test_concurrency_is_bounded():
+    running, peak = 0, 0
+
+    class Slow(FakeCollection):
+        async def bulk_write(self, ops, ordered=False, session=None):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return await super().bulk_write(ops, ordered, session)
+
+    write(Slow(), ops(50), chunk_size=5, concurrency=2)
+    assert peak == 2
+
+
+def test_rejects_invalid_sizes():
+    with pytest.raises(AssertionError):
+        BulkWriter(FakeCollection(), chunk_size=0)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from uuid import uuid4
+import pytest
+from base.di.service_location import service
+from db.cache_helper import CacheInterface, cache, invalidate_tags, tag_version
+
+
+def unique(name: str) -> str:
+    return f'{name}_{uuid4().hex[:8]}'
+
+
+def test_tag_version_changes_only_on_invalidate():
+    tag = unique('t')
+
+    async def main():
+        first = await tag_version([tag])
+        assert await tag_version([tag]) == first
+        await invalidate_tags([tag])
+        assert await tag_version([tag]) != first
+
+    asyncio.run(main())
+
+
+def test_invalidate_tags_expires_tagged_results():
+    tag, other = unique('t'), unique('o')
+    calls = []
+
+    @cache(expire=60, tags=[tag])
+    async def tagged(x: int) -> list:
+        calls.append(x)
+        return [x, len(calls)]
+
+    async def main():
+        assert await tagged(1) == [1, 1]
+        assert await tagged(1) == [1, 1]
+        await invalidate_tags([other])
+        assert await tagged(1) == [1, 1]
+        await invalidate_tags([tag])
+        assert await tagged(1) == [1, 2]
+
+    asyncio.run(main())
+    assert calls == [1, 1]
+
+
+def test_tags_require_a_tag_store(monkeypatch):
+    monkeypatch.delitem(service.configs, 'cache.default')
+    with pytest.raises(ValueError):
+        cache(expire=60, tags=['x'])
+
+
+def test_cached_dao_query_without_tag_store(monkeypatch, mongo_dao):
+    monkeypatch.delitem(service.configs, 'cache.default')
+    dao = mongo_dao()
+
+    async def main():
+        await (await dao.collection).insert_many([{'id': i, 'a': i % 2} for i in range(4)])
+        cached = {'name': 'cache.mem', 'expire': 60}
+        assert await dao.distinct('a', {}, cached=cached) == [0, 1]
+        assert len(await dao.query([{'$match': {'a': 1}}], cached=cached)) == 2
+
+    asyncio.run(main())
+
+
+def test_dao_writes_invalidate_cached_queries(mongo_dao):
+    dao = mongo_dao()
+
+    async def main():
+        cached = {'expire': 60}
+        await dao.save({'id': 1, 'name': 'a'})
+        assert [x['id'] for x in await dao.query([{'$match': {}}], cached=cached)] == [1]
+        await (await dao.collection).insert_one({'id': 3, 'name': 'c'})
+        # 绕过DAO的写入不会失效缓存
+        assert [x['id'] for x in await dao.query([{'$match': {}}], cached=cached)] == [1]
+        await dao.save({'id': 2, 'name': 'b'})
+        assert sorted(x['id'] for x in await dao.query([{'$match': {}}], cached=cached)) == [1, 2, 3]
+
+    asyncio.run(main())
+
+
+def test_backend_without_keys_can_be_defined():
+    class Minimal(CacheInterface):
+        async def get_with_ttl(self, key):
+            return 0, None
+
+        async def get(self, key):
+            return None
+
+        async def set(self, key, value, expire=None):
+            pass
+
+        async def delete(self, key):
+            return 0
+
+    with pytest.raises(NotImplementedError):
+        asyncio.run(Minimal().delete_pattern('*'))
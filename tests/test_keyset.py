@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from db.base_model import SchemaModel
+from db.mongodb.helper.keyset_helper import decode_cursor, encode_cursor, keyset_match, keyset_sort
+
+
+class Item(SchemaModel):
+    fields = ('name',)
+
+
+def pages(dao, sort: dict, page_size: int = 3) -> list:
+    async def main():
+        ids, cursor = [], ''
+        while True:
+            page = await dao.keyset([], cursor, page_size, dict(sort))
+            ids += [x['id'] for x in page['records']]
+            if not page['next']:
+                return ids
+            cursor = page['next']
+
+    return asyncio.run(main())
+
+
+def expected(dao, sort: dict) -> list:
+    return [x['id'] for x in asyncio.run(dao.query([], sort=keyset_sort(sort)))]
+
+
+def seed(dao, documents: list) -> None:
+    async def main():
+        await (await dao.collection).insert_many(documents)
+
+    asyncio.run(main())
+
+
+def test_sort_appends_key_and_rejects_meta():
+    assert keyset_sort({'score': -1}) == {'score': -1, 'id': -1}
+    assert keyset_sort({}) == {'id': 1}
+    with pytest.raises(ValueError):
+        keyset_sort({'score': {'$meta': 'textScore'}})
+
+
+def test_cursor_roundtrip_and_mismatch():
+    sort = keyset_sort({'meta.x': 1})
+    cursor = encode_cursor(sort, {'id': 5, 'meta': {'x': None}})
+    assert decode_cursor(sort, cursor) == [None, 5]
+    with pytest.raises(ValueError):
+        decode_cursor({'id': 1}, cursor)
+    with pytest.raises(ValueError):
+        decode_cursor(sort, 'not a cursor')
+
+
+def test_empty_match_sentinel_matches_nothing():
+    # 降序排在 null 之后已经没有数据
+    assert keyset_match({'a': -1}, [None]) == {'$expr': False}
+
+
+@pytest.mark.parametrize('sort', [{'score': 1}, {'score': -1}])
+def test_pages_through_nulls_and_missing_fields(mongo_dao, sort):
+    dao = mongo_dao()
+    documents = [{'id': i, 'score': i % 3} for i in range(8)]
+    documents += [{'id': 8, 'score': None}, {'id': 9}, {'id': 10, 'score': None}, {'id': 11}]
+    seed(dao, documents)
+    ids = pages(dao, sort)
+    assert ids == expected(dao, sort)
+    assert sorted(ids) == list(range(12))
+
+
+@pytest.mark.parametrize('sort', [{'meta.x': 1}, {'meta.x': -1}])
+def test_pages_through_dotted_keys(mongo_dao, sort):
+    dao = mongo_dao()
+    seed(dao, [{'id': i, 'meta': {'x': i % 4}} for i in range(10)] + [{'id': 10, 'meta': {}}, {'id': 11}])
+    ids = pages(dao, sort)
+    assert ids == expected(dao, sort)
+    assert sorted(ids) == list(range(12))
+
+
+def test_projection_keeps_sort_keys(mongo_dao):
+    dao = mongo_dao(Item())
+    seed(dao, [{'id': i, 'name': f'n{i}', 'score': i % 3} for i in range(10)])
+    ids = pages(dao, {'score': -1})
+    assert ids == expected(dao, {'score': -1})
+
+
+def test_meta_sort_is_rejected(mongo_dao):
+    dao = mongo_dao()
+    with pytest.raises(ValueError):
+        asyncio.run(dao.keyset([], '', 3, {'score': {'$meta': 'textScore'}}))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from db.mongodb.helper.pipeline_optimizer import match_fields, optimize_pipeline, unindexed_match
+
+LOOKUP = {'$lookup': {'from': 'b', 'localField': 'bid', 'foreignField': 'id', 'as': 'b'}}
+
+
+def test_drops_noop_and_merges_adjacent_stages():
+    pipeline = [{'$match': {}}, {'$match': {'a': 1}}, {'$match': {'b': 2}}, {'$skip': 0}, {'$skip': 5}, {'$skip': 5}]
+    pipeline += [{'$limit': 20}, {'$limit': 10}]
+    assert optimize_pipeline(pipeline) == [{'$match': {'a': 1, 'b': 2}}, {'$skip': 10}, {'$limit': 10}]
+
+
+def test_merges_conflicting_matches_with_and():
+    assert optimize_pipeline([{'$match': {'a': 1}}, {'$match': {'a': 2}}]) == [{'$match': {'$and': [{'a': 1}, {'a': 2}]}}]
+
+
+def test_does_not_modify_input():
+    pipeline = [LOOKUP, {'$match': {'a': 1}}]
+    optimize_pipeline(pipeline)
+    assert pipeline == [LOOKUP, {'$match': {'a': 1}}]
+
+
+def test_moves_independent_match_before_lookup():
+    assert optimize_pipeline([LOOKUP, {'$match': {'a': 1}}]) == [{'$match': {'a': 1}}, LOOKUP]
+
+
+def test_keeps_match_on_lookup_output_after_lookup():
+    pipeline = [LOOKUP, {'$match': {'b.name': 'x'}}]
+    assert optimize_pipeline(pipeline) == pipeline
+
+
+def test_splits_match_around_lookup():
+    pipeline = [LOOKUP, {'$match': {'a': 1, 'b.name': 'x'}}]
+    assert optimize_pipeline(pipeline) == [{'$match': {'a': 1}}, LOOKUP, {'$match': {'b.name': 'x'}}]
+
+
+def test_sort_and_paging_pass_lookup_but_not_unwind():
+    pipeline = [LOOKUP, {'$sort': {'a': 1}}, {'$skip': 10}, {'$limit': 5}]
+    assert optimize_pipeline(pipeline) == [{'$sort': {'a': 1}}, {'$skip': 10}, {'$limit': 5}, LOOKUP]
+    unwind = {'$unwind': '$tags'}
+    assert optimize_pipeline([unwind, {'$limit': 5}]) == [unwind, {'$limit': 5}]
+    assert optimize_pipeline([unwind, {'$match': {'a': 1}}]) == [{'$match': {'a': 1}}, unwind]
+    assert optimize_pipeline([unwind, {'$match': {'tags': 'x'}}]) == [unwind, {'$match': {'tags': 'x'}}]
+
+
+def test_expr_match_is_not_moved():
+    pipeline = [LOOKUP, {'$match': {'$expr': {'$eq': ['$a', 1]}}}]
+    assert match_fields(pipeline[1]['$match']) is None
+    assert optimize_pipeline(pipeline) == pipeline
+
+
+def test_unindexed_match():
+    assert unindexed_match({'a': 1}, {'a'}) is None
+    assert unindexed_match({'a': {'$ne': 1}}, {'a'}) == "no index on ['a']"
+    assert unindexed_match({'a': {'$regex': 'x'}}, {'a'}) is not None
+    assert unindexed_match({'a': {'$regex': '^x'}}, {'a'}) is None
+    assert unindexed_match({'$or': [{'a': 1}, {'b': 1}]}, {'a'}) == 'has $or branches on unindexed fields'
+    assert unindexed_match({'$expr': {'$eq': ['$a', 1]}}, {'a'}) == 'uses $expr/$where'
@@ -6,11 +6,13 @@ from base.di.service_location import service
 from base.functions import env
 from web.routes.base_router import JSONResponse
 from base.coroutine.context import context
+from db.mongodb.helper.data_loader import reset_memo, start_memo
 from web.routes.request_context import request_context
 
 
 class RequestContextMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        token = start_memo()
         try:
             context.set('message_id', service.id_generator.generate_id())
             request_context.set(request)
@@ -19,4 +21,5 @@ class RequestContextMiddleware(BaseHTTPMiddleware):
             return JSONResponse(status_code=500, code=500, msg=str(e) if env('DEBUG') else 'Internal Server Error')
         finally:
             context.clear()
+            reset_memo(token)
         return response
@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import importlib
 import inspect
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 from fastapi import FastAPI, status
+from loguru import logger
 from starlette.exceptions import HTTPException
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from base.functions import env
 from base.di.service_location import service
 from base.util.wraps import event
+from db.mongodb.change_watcher import close_watchers, start_watchers
+from db.milvus.meta_cache import close_meta_caches
+from db.milvus.runner import shutdown_runners
+from db.mongodb.helper.write_buffer import close_buffers
 from web.middleware.request_context_middleware import RequestContextMiddleware
 from web.routes.base_router import JSONResponse
 from web.routes.base_router import auto_import
@@ -19,9 +26,10 @@ class App:
     def app(self) -> FastAPI:
         return self._app
 
-    def __init__(self, before_import: list = [], after_import: list = []) -> None:
+    def __init__(self, before_import: list = [], after_import: list = [], warm_up: bool = True) -> None:
         self._before_import = before_import
         self._after_import = after_import
+        self._warm_up = warm_up
         self._app = None
 
     def run(self, app: FastAPI) -> None:
@@ -50,9 +58,42 @@ class App:
     async def liefspan(self, app: FastAPI) -> AsyncGenerator:
         service.refresh()
         await self._event(self._before_import)
+        if self._warm_up:
+            await self.warm_up()
         auto_import(env('ROUTE_PATH'), app)
         await self._event(self._after_import)
-        yield
+        # 路由导入时创建的 watcher 在此统一启动
+        await start_watchers()
+        try:
+            yield
+        finally:
+            await close_buffers()
+            await close_watchers()
+            await close_meta_caches()
+            shutdown_runners()
+
+    async def warm_up(self, prefix: str = 'db.') -> None:
+        '''
+        预热所有 db.* 服务(实现了 warm_up 的), 失败只记录日志, 不阻止启动
+        '''
+        services = []
+        for name, value in service.configs.items():
+            if not name.startswith(prefix) or not isinstance(value, dict) or not value.get('()'):
+                continue
+            try:
+                # 先按类判断是否需要预热, 不需要的服务不提前创建
+                module, cls = value['()'].rsplit('.', 1)
+                if getattr(getattr(importlib.import_module(module), cls), 'warm_up', None) is None:
+                    continue
+                services.append((name, service.get(name)))
+            except Exception:
+                logger.error(f"Warm up {name} failed", exc_info=True)
+        results = await asyncio.gather(*[x.warm_up() for _, x in services], return_exceptions=True)
+        for (name, _), result in zip(services, results):
+            if isinstance(result, BaseException):
+                logger.opt(exception=result).error(f"Warm up {name} failed")
+            else:
+                logger.info(f"Warm up {name}: {result}")
 
     async def _event(self, events=[]) -> None:
         for func in events:
@@ -4,8 +4,9 @@ import inspect
 from json import JSONDecodeError
 import os, xmltodict
 from fastapi import APIRouter, BackgroundTasks, FastAPI, HTTPException, Request, status
-from fastapi.responses import ORJSONResponse as _JSONResponse
-from typing import Optional
+from fastapi.responses import ORJSONResponse as _JSONResponse, StreamingResponse
+from typing import AsyncGenerator, Optional, Union
+from base.coder.json_coder import ORJSONCoder
 from db.base_model import BaseModel
 from db.da_interface import DaInterface
 from base.functions import to_lower_camel
@@ -73,6 +74,9 @@ def add_route(
             paged = matcher.pop('page{}', {})
             page = int(paged.pop('page', matcher.pop('page', page)))
             pageSize = int(paged.pop('pageSize', matcher.pop('pageSize', pageSize)))
+            cursor = paged.pop('cursor', matcher.pop('cursor', None))
+            with_total = str(paged.pop('withTotal', matcher.pop('withTotal', False))).lower() in ('1', 'true')
+            count_mode = paged.pop('countMode', matcher.pop('countMode', 'exact'))
             if model.key_style == BaseModel.STYLE_LOWER_CAMEL:
                 matcher = to_lower_camel(matcher)
             sort = matcher.pop('sort{}', None)
@@ -86,7 +90,20 @@ def add_route(
                 param = manager.default_query(matcher)
             if not param:
                 return []
-            result = await manager.index(param, page=page, page_size=pageSize, sort=sort, cached=cached.get('index'))
+            try:
+                result = await manager.index(
+                    param,
+                    page=page,
+                    page_size=pageSize,
+                    sort=sort,
+                    cached=cached.get('index'),
+                    cursor=cursor,
+                    with_total=with_total,
+                    count=count_mode,
+                    count_cached=cached.get('count'),
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
             if 'index' in after_events:
                 result['records'] = (
                     await after_events['index'](matcher, result['records'])
@@ -99,13 +116,14 @@ def add_route(
 
         @router.post("/list")
         @router.get("/list")
-        async def all(request: Request, page: Optional[int] = 1, pageSize: Optional[int] = 0) -> list:
+        async def all(request: Request, page: Optional[int] = 1, pageSize: Optional[int] = 0) -> Union[list, dict]:
             matcher = await request_body(request)
             query = matcher.pop('query{}', {})
             matcher = dict(matcher, **query)
             paged = matcher.pop('page{}', {})
             page = int(paged.pop('page', matcher.pop('page', page)))
             pageSize = int(paged.pop('pageSize', matcher.pop('pageSize', pageSize)))
+            cursor = paged.pop('cursor', matcher.pop('cursor', None))
             if model.key_style == BaseModel.STYLE_LOWER_CAMEL:
                 matcher = to_lower_camel(matcher)
             sort = matcher.pop('sort{}', None)
@@ -119,6 +137,20 @@ def add_route(
                 param = manager.default_query(matcher)
             if not param:
                 return []
+            if cursor is not None:
+                # 游标模式必须分页, 未指定 pageSize 时与分页接口默认值一致
+                pageSize = pageSize if pageSize > 0 else 20
+                try:
+                    result = await manager.keyset(param, cursor, page_size=pageSize, sort=sort, cached=cached.get('list'))
+                except ValueError as e:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+                if 'list' in after_events:
+                    result['records'] = (
+                        await after_events['list'](matcher, result['records'])
+                        if inspect.iscoroutinefunction(after_events['list'])
+                        else after_events['list'](matcher, result['records'])
+                    )
+                return result
             result = (await manager.query(param, sort=sort, page=page, page_size=pageSize, cached=cached.get('list'))) or []
             if 'list' in after_events:
                 result = (
@@ -129,6 +161,41 @@ def add_route(
 
             return result
 
+    if 'stream' not in exclude:
+
+        @router.post("/stream")
+        @router.get("/stream")
+        async def stream(request: Request, batchSize: Optional[int] = 1000) -> StreamingResponse:
+            matcher = await request_body(request)
+            query = matcher.pop('query{}', {})
+            matcher = dict(matcher, **query)
+            batch_size = int(matcher.pop('batchSize', batchSize))
+            if model.key_style == BaseModel.STYLE_LOWER_CAMEL:
+                matcher = to_lower_camel(matcher)
+            sort = matcher.pop('sort{}', None)
+            if 'stream' in before_events:
+                param = (
+                    await before_events['stream'](matcher)
+                    if inspect.iscoroutinefunction(before_events['stream'])
+                    else before_events['stream'](matcher)
+                )
+            else:
+                param = manager.default_query(matcher)
+
+            async def content() -> AsyncGenerator:
+                if not param:
+                    return
+                async for batch in manager.iter_query(param, sort=sort, batch_size=batch_size, batched=True):
+                    if 'stream' in after_events:
+                        batch = (
+                            await after_events['stream'](matcher, batch)
+                            if inspect.iscoroutinefunction(after_events['stream'])
+                            else after_events['stream'](matcher, batch)
+                        )
+                    yield b''.join(ORJSONCoder.encode(x) + b'\n' for x in batch)
+
+            return StreamingResponse(content(), media_type='application/x-ndjson')
+
     if 'get' not in exclude:
 
         @router.post("/get")
@@ -153,7 +220,13 @@ def add_route(
                 param = manager.default_query(matcher if not id else dict(matcher, **{'id': id}))
             if not param:
                 return {}
-            result = ((await manager.query(param, sort=sort, cached=cached.get('get'))) or [{}]).pop(0)
+            # path参数会合并进matcher, 只有 {'id': id} 时才是单纯的主键查询
+            # 未实现 load 的 manager 仍走 query
+            loadable = type(manager).load is not DaInterface.load
+            if loadable and id and matcher == {'id': id} and 'get' not in before_events and not cached.get('get'):
+                result = await manager.load(id)
+            else:
+                result = ((await manager.query(param, sort=sort, cached=cached.get('get'))) or [{}]).pop(0)
             if 'get' in after_events:
                 result = (
                     await after_events['get'](matcher, result)
@@ -219,10 +292,11 @@ def add_route(
 
         @router.get("/count")
         @router.post("/count")
-        async def count(request: Request) -> int:
+        async def count(request: Request) -> Union[int, str]:
             matcher = await request_body(request)
             query = matcher.pop('query{}', {})
             matcher = dict(matcher, **query)
+            count_mode = matcher.pop('countMode', 'exact')
             if model.key_style == BaseModel.STYLE_LOWER_CAMEL:
                 matcher = to_lower_camel(matcher)
             if 'count' in before_events:
@@ -233,7 +307,9 @@ def add_route(
                 )
             else:
                 param = manager.default_query(matcher)
-            result = await manager.count_query(param, cached=cached.get('distinct'))
+            result = await manager.count_query(
+                param, cached=cached.get('count' if count_mode == 'cached' else 'distinct'), count=count_mode
+            )
             if 'count' in after_events:
                 result = (
                     await after_events['count'](param, result)
@@ -288,6 +364,12 @@ def add_route(
                 )
             return result
 
+    if 'index_advice' not in exclude:
+
+        @router.get("/index_advice")
+        async def index_advice() -> dict:
+            return manager.index_advice()
+
 
 class BaseRouter:
     @property
@@ -302,7 +384,7 @@ class BaseRouter:
         before_events: dict = {},
         after_events: dict = {},
         cached: dict = {},
-        exclude: list = ['delete'],
+        exclude: list = ['delete', 'index_advice', 'stream'],
     ) -> None:
         self._router = router
         self._router.default_response_class = JSONResponse